@@ -0,0 +1,16 @@
+"""Per-call cost of tag sanitization with and without the LRU cache."""
+import timeit
+from tb_chainer.summary import _clean_tag
+from tb_chainer.record_writer import make_valid_tf_name
+
+tags = ['main/loss', 'main/accuracy', 'validation/main/loss',
+        'predictor/conv1_1/W', 'lr (x1000)'] * 60
+n = 2000
+
+for name, fn in [('_clean_tag', _clean_tag),
+                 ('make_valid_tf_name', make_valid_tf_name)]:
+    uncached = timeit.timeit(lambda: [fn.__wrapped__(t) for t in tags], number=n)
+    cached = timeit.timeit(lambda: [fn(t) for t in tags], number=n)
+    calls = n * len(tags)
+    print('%-20s uncached %.3f us/call, cached %.3f us/call, %s' %
+          (name, uncached / calls * 1e6, cached / calls * 1e6, fn.cache_info()))
@@ -0,0 +1,27 @@
+"""Write throughput and bytes on disk of parameter histograms per event file
+compression."""
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from tb_chainer import SummaryWriter
+from tb_chainer.event_file_reader import event_files
+
+params = [np.random.randn(256, 256).astype(np.float32) for _ in range(20)]
+n = 50
+
+for compression in [None, 'zlib', 'gzip']:
+    logdir = tempfile.mkdtemp()
+    writer = SummaryWriter(logdir, compression=compression, max_queue=1000)
+    start = time.time()
+    for step in range(n):
+        for i, p in enumerate(params):
+            writer.add_histogram('layer%d/W' % i, p, step)
+    writer.close()
+    elapsed = time.time() - start
+    size = sum(os.path.getsize(path) for path in event_files(logdir))
+    print('%-5s %7.1f histograms/s, %8.1f KiB on disk' %
+          (compression, n * len(params) / elapsed, size / 1024.))
+    shutil.rmtree(logdir)
@@ -0,0 +1,36 @@
+"""Encoding time and size of image summaries per format."""
+import time
+
+import numpy as np
+from tb_chainer.summary import make_image
+from tb_chainer.utils import make_grid
+
+rng = np.random.RandomState(0)
+y, x = np.mgrid[0:720, 0:1280] / 720.
+photo = np.stack([np.sin(3 * x + y), np.cos(2 * y), x * y / 2]) * 0.4 + 0.5
+photo += rng.normal(0, 0.03, photo.shape)
+mask = np.zeros((1, 720, 1280))
+for i in range(8):
+    cy, cx, r = rng.randint(0, 720), rng.randint(0, 1280), rng.randint(40, 200)
+    mask[0][(y * 720 - cy) ** 2 + (x * 720 - cx) ** 2 < r ** 2] = (i + 1) / 8.
+features = make_grid(rng.rand(64, 1, 28, 28))
+images = [('photo 1280x720', photo), ('mask 1280x720', mask),
+          ('feature grid', features)]
+
+encodings = [('png', None),
+             ('png level 1', {'format': 'png', 'compress_level': 1}),
+             ('png level 9', {'format': 'png', 'compress_level': 9}),
+             ('jpeg q75', {'format': 'jpeg', 'quality': 75}),
+             ('jpeg q90', {'format': 'jpeg', 'quality': 90}),
+             ('webp q80', {'format': 'webp', 'quality': 80}),
+             ('webp lossless', {'format': 'webp', 'lossless': True})]
+
+for name, img in images:
+    hwc = (np.clip(img, 0, 1) * 255).astype(np.uint8).transpose(1, 2, 0).copy()
+    print(name)
+    for label, encoding in encodings:
+        n = 5
+        start = time.time()
+        for _ in range(n):
+            size = len(make_image(hwc, encoding).encoded_image_string)
+        print('  %-14s %8.2f ms %10d bytes' % (label, (time.time() - start) / n * 1e3, size))
@@ -6,12 +6,11 @@ from setuptools import setup, find_packages
 requirements = [
     'protobuf',
     'six',
-    'moviepy'
+    'pillow'
 ]
 
 test_requirements = [
-    'pytest',
-    'moviepy'
+    'pytest'
 ]
 
 setup(
@@ -1,7 +1,15 @@
 """A module for visualization with tensorboard
 """
+import sys
 
 from .writer import FileWriter, SummaryWriter
+if sys.version_info >= (3, 5):
+    from .async_writer import AsyncSummaryWriter
+from .event_file_writer import WriterService, shared_writer_service
+from .distributed import SummaryAggregator, RankSummaryWriter
 from .record_writer import RecordWriter
+from .record_reader import RecordReader
+from .event_file_reader import EventFileReader, read_events
+from .scalar_export import read_scalars
 from .name_scope import name_scope, within_name_scope, register_functions
 from .graph import NodeName
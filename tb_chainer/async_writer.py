@@ -0,0 +1,234 @@
+"""A `SummaryWriter` for asyncio programs."""
+
+import asyncio
+import collections
+import os
+import time
+
+from .event_file_writer import EventsWriter, directory_check, _build_event
+from .writer import SummaryToEventTransformer, SummaryWriter
+
+# Put into the queue to stop the writing task.
+_STOP = object()
+
+
+class _AsyncEventFileWriter(object):
+    """Writes events to an event file from an asyncio task.
+
+    `add_event` only collects the events. `put_pending()` moves them into a
+    bounded `asyncio.Queue`, waiting for room without blocking the event
+    loop, and a task writes them in batches in the loop's default executor.
+    """
+
+    def __init__(self, logdir, max_queue=10, flush_secs=120,
+                 max_batch_size=1024, max_file_size=None, max_file_secs=None,
+                 compress_segments=False, retention_bytes=None,
+                 compression=None, filename_suffix=''):
+        self._logdir = logdir
+        directory_check(self._logdir)
+        self._ev_writer = EventsWriter(os.path.join(self._logdir, "events"),
+                                       flush_secs, max_file_size,
+                                       max_file_secs, compress_segments,
+                                       retention_bytes, compression,
+                                       filename_suffix=filename_suffix)
+        self._max_queue = max_queue
+        self._flush_secs = flush_secs
+        self._max_batch_size = max_batch_size
+        self._pending = collections.deque()
+        self._queue = None
+        self._task = None
+        self._closed = False
+        # The first event will be flushed immediately.
+        self._next_event_flush_time = 0
+
+    def get_logdir(self):
+        """Returns the directory where event file will be written."""
+        return self._logdir
+
+    def add_event(self, event):
+        if not self._closed:
+            self._pending.append(event)
+
+    async def put_pending(self):
+        """Hands the added events over to the writing task."""
+        if self._closed:
+            return
+        if self._task is None:
+            self._queue = asyncio.Queue(self._max_queue)
+            self._task = asyncio.ensure_future(self._run())
+        while self._pending:
+            await self._queue.put(self._pending.popleft())
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                event = await asyncio.wait_for(
+                    self._queue.get(),
+                    max(self._next_event_flush_time - time.time(), 0.01))
+            except asyncio.TimeoutError:
+                # Nothing arrived for a while, flush what is buffered.
+                await loop.run_in_executor(None, self._flush)
+                continue
+            events = [event]
+            while len(events) < self._max_batch_size and not self._queue.empty():
+                events.append(self._queue.get_nowait())
+            stop = _STOP in events
+            try:
+                await loop.run_in_executor(
+                    None, self._write, [e for e in events if e is not _STOP])
+            finally:
+                for _ in events:
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def _write(self, events):
+        self._ev_writer.write_events(
+            [e for e in map(_build_event, events) if e is not None])
+        # Flush the event writer every so often.
+        if time.time() > self._next_event_flush_time:
+            self._flush()
+
+    def _flush(self):
+        self._ev_writer.flush()
+        self._next_event_flush_time = time.time() + self._flush_secs
+
+    async def flush(self):
+        """Waits until all added events are written and flushed to disk."""
+        if self._closed:
+            return
+        await self.put_pending()
+        await self._queue.join()
+        await asyncio.get_event_loop().run_in_executor(None, self._flush)
+
+    async def close(self):
+        """Flushes the event file to disk and closes the file."""
+        if self._closed:
+            return
+        await self.flush()
+        # Cancelling the task would not stop a write or flush it already
+        # runs in the executor, so it is asked to return after it instead.
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+        await asyncio.get_event_loop().run_in_executor(None, self._ev_writer.close)
+        self._closed = True
+
+    def reopen(self):
+        """Starts a new event file after `close()`."""
+        if self._closed:
+            self._ev_writer.reopen()
+            self._closed = False
+
+
+class _AsyncFileWriter(SummaryToEventTransformer):
+    """`FileWriter` counterpart writing through an `_AsyncEventFileWriter`."""
+
+    def __init__(self, logdir, **kwargs):
+        super(_AsyncFileWriter, self).__init__(
+            _AsyncEventFileWriter(logdir, **kwargs))
+
+    def get_logdir(self):
+        return self.event_writer.get_logdir()
+
+    def add_event(self, event):
+        self.event_writer.add_event(event)
+
+    def get_num_dropped_events(self):
+        # Adding an event waits for room in the queue instead of dropping.
+        return 0
+
+
+class AsyncSummaryWriter(SummaryWriter):
+    """A `SummaryWriter` whose methods are coroutines.
+
+    Events are passed to the writing task through an `asyncio.Queue` of
+    `max_queue` events, so adding an event waits for room without blocking
+    the event loop, and the file I/O runs in the loop's default executor.
+    The event files are the same as those of `SummaryWriter`. With
+    `deferred=True` images, histograms, audio and videos are also encoded
+    in the executor instead of the event loop.
+
+    Keyword arguments `max_queue`, `flush_secs`, `max_batch_size`,
+    `max_file_size`, `max_file_secs`, `compress_segments`, `retention_bytes`,
+    `compression` and `filename_suffix` are supported as for `FileWriter`.
+    """
+
+    def _make_file_writer(self, logdir):
+        return _AsyncFileWriter(logdir, **self._file_writer_kwargs)
+
+    def _file_writers(self):
+        return [self.file_writer] + list(self.all_writers.values())
+
+    async def _put_pending(self):
+        for writer in self._file_writers():
+            await writer.event_writer.put_pending()
+
+    async def add_scalar(self, name, scalar_value, global_step=None):
+        SummaryWriter.add_scalar(self, name, scalar_value, global_step)
+        await self._put_pending()
+
+    async def add_scalars(self, tag_scalar_dict, global_step=None, main_tag=None):
+        SummaryWriter.add_scalars(self, tag_scalar_dict, global_step, main_tag)
+        await self._put_pending()
+
+    async def add_histogram(self, name, values, global_step=None, bins='tensorflow'):
+        SummaryWriter.add_histogram(self, name, values, global_step, bins)
+        await self._put_pending()
+
+    async def add_image(self, tag, img_tensor, global_step=None, dataformats='CHW',
+                        encoding=None):
+        SummaryWriter.add_image(self, tag, img_tensor, global_step, dataformats,
+                                encoding)
+        await self._put_pending()
+
+    async def add_images(self, tag, img_tensor, global_step=None, max_outputs=3,
+                         dataformats='NCHW', encoding=None):
+        SummaryWriter.add_images(self, tag, img_tensor, global_step, max_outputs,
+                                 dataformats, encoding)
+        await self._put_pending()
+
+    async def add_audio(self, tag, snd_tensor, global_step=None):
+        SummaryWriter.add_audio(self, tag, snd_tensor, global_step)
+        await self._put_pending()
+
+    async def add_video(self, tag, vid_tensor, global_step=None, fps=4, encoding=None):
+        SummaryWriter.add_video(self, tag, vid_tensor, global_step, fps, encoding)
+        await self._put_pending()
+
+    async def add_text(self, tag, text_string, global_step=None):
+        SummaryWriter.add_text(self, tag, text_string, global_step)
+        await self._put_pending()
+
+    async def add_graph(self, last_var):
+        SummaryWriter.add_graph(self, last_var)
+        await self._put_pending()
+
+    async def add_all_parameter_histograms(self, last_var, global_step=None, pattern='.*'):
+        SummaryWriter.add_all_parameter_histograms(self, last_var, global_step, pattern)
+        await self._put_pending()
+
+    async def add_all_variable_images(self, last_var, exclude_params=True, global_step=None, pattern='.*'):
+        SummaryWriter.add_all_variable_images(self, last_var, exclude_params, global_step, pattern)
+        await self._put_pending()
+
+    async def flush(self):
+        """Waits until all added events are written to disk."""
+        for writer in self._file_writers():
+            await writer.event_writer.flush()
+
+    async def close(self):
+        for writer in self._file_writers():
+            await writer.event_writer.close()
+        if self._encoder is not None:
+            await asyncio.get_event_loop().run_in_executor(
+                None, self._encoder.shutdown)
+
+    def __del__(self):
+        # `__init__` may have failed before creating the writers.
+        writers = [getattr(self, 'file_writer', None)] + \
+            list(getattr(self, 'all_writers', {}).values())
+        for writer in writers:
+            if writer is not None:
+                writer.event_writer._ev_writer.close()
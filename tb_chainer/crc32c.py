@@ -1,4 +1,22 @@
+from __future__ import absolute_import
+
 import array
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import crc32c as _crc32c_ext
+except ImportError:
+    _crc32c_ext = None
+
+try:
+    import google_crc32c as _google_crc32c
+except ImportError:
+    _google_crc32c = None
 
 
 CRC_TABLE = (
@@ -73,23 +91,31 @@ CRC_INIT = 0
 
 _MASK = 0xFFFFFFFF
 
+# Inputs shorter than this are not worth the NumPy call overhead.
+_NUMPY_MIN_SIZE = 4096
 
-def crc_update(crc, data):
-    """Update CRC-32C checksum with data.
+# Number of bytes each lane covers in the NumPy backend.
+_LANE_SIZE = 256
 
-    Args:
-      crc: 32-bit checksum to update as long.
-      data: byte array, string or iterable over bytes.
 
-    Returns:
-      32-bit updated CRC-32C as long.
-    """
+def _as_buffer(data):
+    """Returns `data` as something iterable over byte values without copying
+    when the object supports the buffer protocol."""
+    if type(data) == array.array and data.itemsize == 1:
+        return data
+    if sys.version_info[0] >= 3:
+        try:
+            view = memoryview(data)
+        except TypeError:
+            return array.array("B", data)
+        if view.format != "B" or view.ndim != 1:
+            view = view.cast("B")
+        return view
+    return array.array("B", data)
 
-    if type(data) != array.array or data.itemsize != 1:
-        buf = array.array("B", data)
-    else:
-        buf = data
 
+def _python_crc_update(crc, data):
+    buf = _as_buffer(data)
     crc ^= _MASK
     for b in buf:
         table_index = (crc ^ b) & 0xff
@@ -97,6 +123,110 @@ def crc_update(crc, data):
     return crc ^ _MASK
 
 
+_np_tables = {}
+
+
+def _numpy_tables():
+    """Builds the lookup tables of the NumPy backend on first use.
+
+    `table` is `CRC_TABLE` as an array and `shift` holds four 256 entry
+    tables which advance a raw CRC register over `_LANE_SIZE` zero bytes.
+    """
+    if not _np_tables:
+        table = np.array(CRC_TABLE, dtype=np.uint32)
+        regs = (np.arange(256, dtype=np.uint32)[None, :]
+                << (8 * np.arange(4, dtype=np.uint32))[:, None])
+        for _ in range(_LANE_SIZE):
+            regs = table[regs & 0xff] ^ (regs >> 8)
+        _np_tables['table'] = table
+        _np_tables['shift'] = [[int(v) for v in row] for row in regs]
+    return _np_tables['table'], _np_tables['shift']
+
+
+def _numpy_crc_update(crc, data):
+    """CRC-32C over interleaved lanes.
+
+    The input is cut into lanes of `_LANE_SIZE` bytes whose raw CRC registers
+    are computed side by side with NumPy, one byte column at a time. Since the
+    CRC is linear over GF(2), the lane registers are then chained together by
+    shifting the running register over `_LANE_SIZE` zero bytes and XORing in
+    the next lane. The remainder is handled by the table driven loop.
+    """
+    buf = np.frombuffer(_as_buffer(data), dtype=np.uint8)
+    if len(buf) < _NUMPY_MIN_SIZE:
+        return _python_crc_update(crc, buf)
+    n_lanes = len(buf) // _LANE_SIZE
+    table, (s0, s1, s2, s3) = _numpy_tables()
+    lanes = buf[:n_lanes * _LANE_SIZE].reshape(n_lanes, _LANE_SIZE)
+    regs = np.zeros(n_lanes, dtype=np.uint32)
+    for column in lanes.T:
+        regs = table[(regs ^ column) & 0xff] ^ (regs >> 8)
+    reg = crc ^ _MASK
+    for lane_reg in regs.tolist():
+        reg = (s0[reg & 0xff] ^ s1[(reg >> 8) & 0xff] ^
+               s2[(reg >> 16) & 0xff] ^ s3[reg >> 24] ^ lane_reg)
+    crc = reg ^ _MASK
+    return _python_crc_update(crc, buf[n_lanes * _LANE_SIZE:])
+
+
+def _crc32c_ext_update(crc, data):
+    return _crc32c_ext.crc32c(data, crc)
+
+
+def _google_crc32c_update(crc, data):
+    return _google_crc32c.extend(crc, bytes(data))
+
+
+_BACKENDS = [('python', _python_crc_update)]
+if np is not None:
+    _BACKENDS.insert(0, ('numpy', _numpy_crc_update))
+if _google_crc32c is not None:
+    _BACKENDS.insert(0, ('google_crc32c', _google_crc32c_update))
+if _crc32c_ext is not None and hasattr(_crc32c_ext, 'crc32c'):
+    _BACKENDS.insert(0, ('crc32c', _crc32c_ext_update))
+
+_backend = _BACKENDS[0]
+
+
+def available_backends():
+    """Returns the names of the usable CRC-32C backends, fastest first."""
+    return [name for name, _ in _BACKENDS]
+
+
+def get_backend():
+    """Returns the name of the backend used by `crc_update`."""
+    return _backend[0]
+
+
+def set_backend(name):
+    """Selects the implementation used by `crc_update`.
+
+    Args:
+      name: One of `available_backends()`.
+    """
+    global _backend
+    for backend in _BACKENDS:
+        if backend[0] == name:
+            _backend = backend
+            return
+    raise ValueError("Unknown or unavailable CRC-32C backend: %s" % name)
+
+
+def crc_update(crc, data):
+    """Update CRC-32C checksum with data.
+
+    Args:
+      crc: 32-bit checksum to update as long.
+      data: bytes-like object (bytes, bytearray, memoryview, array) or
+        iterable over bytes. Objects supporting the buffer protocol are not
+        copied.
+
+    Returns:
+      32-bit updated CRC-32C as long.
+    """
+    return _backend[1](crc, data)
+
+
 def crc_finalize(crc):
     """Finalize CRC-32C checksum.
 
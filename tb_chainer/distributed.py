@@ -0,0 +1,316 @@
+"""Logging from several processes, e.g. the ranks of a ChainerMN job, into
+one event stream.
+
+Each rank writes through a `RankSummaryWriter`, which sends the serialized
+events over a local socket or pipe to a `SummaryAggregator`. The aggregator
+reduces the scalars of a tag and step over all ranks and writes the results
+with a single `FileWriter`::
+
+    # On one process, e.g. rank 0, before the ranks start logging.
+    aggregator = SummaryAggregator('runs/exp', num_ranks=comm.size)
+    address = comm.bcast_obj(aggregator.address if comm.rank == 0 else None)
+    writer = RankSummaryWriter('runs/exp', address, comm.rank)
+    ...
+    writer.close()
+    if comm.rank == 0:
+        aggregator.close()
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import logging
+import os
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+import six
+
+from .src import event_pb2
+from .event_encoder import ScalarEventEncoder
+from .writer import FileWriter, SummaryToEventTransformer, SummaryWriter
+
+REDUCTIONS = {'mean': np.mean, 'min': np.min, 'max': np.max}
+
+
+class SummaryAggregator(object):
+    """Receives the events of `num_ranks` `RankSummaryWriter`s and writes one
+    event stream.
+
+    Scalar values are collected per run, tag and step. Once every rank has
+    sent its value, or has closed its writer, they are reduced with each of
+    `reductions`. The mean is written under the original tag and the other
+    reductions under `<tag>/<reduction>`. Other summary values are written
+    unchanged with their tag prefixed by `rank<rank>/`, and graphs and other
+    events only from rank 0. Scalars added without a global step all have
+    step 0, so each rank should pass the step.
+    """
+
+    def __init__(self, log_dir, num_ranks, reductions=('mean', 'min', 'max'),
+                 address=None, authkey=None, **kwargs):
+        """
+        Args:
+          log_dir: A string. Directory where the event file will be written.
+          num_ranks: Integer. Number of `RankSummaryWriter`s.
+          reductions: Names of the reductions applied to scalars, from
+            `REDUCTIONS`.
+          address: Address to listen at, see
+            `multiprocessing.connection.Listener`. By default a fresh local
+            socket or pipe. A `(host, port)` tuple accepts ranks on other
+            nodes and requires an `authkey`.
+          authkey: Bytes. Key the ranks must authenticate with. Optional
+            for local sockets and pipes.
+          kwargs: Passed to `FileWriter`. The event file names end with
+            `.aggregated.<pid>` unless `filename_suffix` is given.
+        """
+        for name in reductions:
+            if name not in REDUCTIONS:
+                raise ValueError("reductions must be from %s, but got %r"
+                                 % (sorted(REDUCTIONS), name))
+        if isinstance(address, tuple) and authkey is None:
+            raise ValueError("authkey is required to listen at a (host, port) "
+                             "address, got %r" % (address,))
+        self._log_dir = log_dir
+        self._num_ranks = num_ranks
+        self._reductions = reductions
+        kwargs.setdefault('filename_suffix', '.aggregated.%d' % os.getpid())
+        self._file_writer_kwargs = kwargs
+        self._encoder = ScalarEventEncoder()
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+        # Run -> FileWriter.
+        self._writers = {}
+        # (run, tag, step) -> {rank: (wall_time, value)}.
+        self._pending = {}
+        # Run -> ranks which have closed their writer.
+        self._finished = {}
+        self._num_connections = 0
+        self._num_main_connections = 0
+        self._closed = False
+        self._listener = Listener(address, authkey=authkey)
+        self._accept_thread = threading.Thread(target=self._accept)
+        self._accept_thread.daemon = True
+        self._accept_thread.start()
+
+    @property
+    def address(self):
+        """The address to pass to `RankSummaryWriter`."""
+        return self._listener.address
+
+    def _accept(self):
+        while True:
+            try:
+                conn = self._listener.accept()
+            except Exception:
+                if self._closed:
+                    return
+                # E.g. a client failed to authenticate or disconnected.
+                logging.warning('Failed to accept a connection from a rank.',
+                                exc_info=True)
+                continue
+            thread = threading.Thread(target=self._receive, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def _receive(self, conn):
+        try:
+            # Not `recv()`, which would unpickle data sent by the client.
+            rank, run = json.loads(conn.recv_bytes().decode('utf-8'))
+            if not isinstance(rank, six.integer_types) or \
+                    not 0 <= rank < self._num_ranks or \
+                    not isinstance(run, six.string_types) or \
+                    not _is_subdirectory(run):
+                raise ValueError('Invalid handshake %r' % ([rank, run],))
+        except Exception:
+            logging.warning('Failed to receive the handshake of a rank.',
+                            exc_info=True)
+            conn.close()
+            return
+        with self._lock:
+            self._num_connections += 1
+            if run == '':
+                self._num_main_connections += 1
+        try:
+            while True:
+                try:
+                    event_str = conn.recv_bytes()
+                except EOFError:
+                    break
+                self._add(run, rank, event_pb2.Event.FromString(event_str))
+        finally:
+            conn.close()
+            with self._lock:
+                self._finished.setdefault(run, set()).add(rank)
+                if not self._closed:
+                    for key in [k for k in self._pending if k[0] == run]:
+                        self._maybe_reduce(key)
+                self._num_connections -= 1
+                self._done.notify_all()
+
+    def _writer(self, run):
+        if run not in self._writers:
+            self._writers[run] = FileWriter(os.path.join(self._log_dir, run),
+                                            **self._file_writer_kwargs)
+        return self._writers[run]
+
+    def _add(self, run, rank, event):
+        with self._lock:
+            if self._closed:
+                return
+            if not event.HasField('summary'):
+                if rank == 0:
+                    self._writer(run).add_event(event)
+                return
+            others = []
+            for value in event.summary.value:
+                if value.HasField('simple_value'):
+                    key = (run, value.tag, event.step)
+                    values = self._pending.setdefault(key, {})
+                    values[rank] = (event.wall_time, value.simple_value)
+                    self._maybe_reduce(key)
+                else:
+                    value.tag = 'rank%d/%s' % (rank, value.tag)
+                    others.append(value)
+            if others:
+                del event.summary.value[:]
+                event.summary.value.extend(others)
+                self._writer(run).add_event(event)
+
+    def _maybe_reduce(self, key):
+        values = self._pending[key]
+        finished = self._finished.get(key[0], ())
+        if any(r not in values and r not in finished
+               for r in range(self._num_ranks)):
+            return
+        del self._pending[key]
+        self._write_reduced(key, values)
+
+    def _write_reduced(self, key, values):
+        run, tag, step = key
+        wall_time = max(t for t, _ in values.values())
+        scalars = np.array([v for _, v in values.values()])
+        writer = self._writer(run)
+        for name in self._reductions:
+            reduced_tag = tag if name == 'mean' else tag + '/' + name
+            writer.add_event(self._encoder.encode(
+                reduced_tag, REDUCTIONS[name](scalars), step, wall_time))
+
+    def close(self, timeout=None):
+        """Waits until all ranks have closed their writers, then writes the
+        remaining scalars and closes the event files.
+
+        Args:
+          timeout: Optional number. Seconds to wait for the ranks, e.g. in
+            case one of them died. The scalars received until then are
+            reduced over the ranks which sent them.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._lock:
+            while self._num_main_connections < self._num_ranks or \
+                    self._num_connections:
+                if deadline is None:
+                    self._done.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    logging.warning(
+                        'Closing the aggregator with %d of %d ranks connected '
+                        'and %d connections open.', self._num_main_connections,
+                        self._num_ranks, self._num_connections)
+                    break
+                self._done.wait(remaining)
+            self._closed = True
+            for key in sorted(self._pending, key=lambda k: k[2]):
+                self._write_reduced(key, self._pending[key])
+            self._pending.clear()
+        self._listener.close()
+        for writer in self._writers.values():
+            writer.close()
+
+
+def _is_subdirectory(run):
+    """Whether `run` is a path inside of the log directory."""
+    if os.path.isabs(run) or os.path.splitdrive(run)[0]:
+        return False
+    path = os.path.normpath(run)
+    return path != os.pardir and not path.startswith(os.pardir + os.sep)
+
+
+class _RankEventWriter(object):
+    """Sends events to a `SummaryAggregator` instead of writing them."""
+
+    def __init__(self, address, authkey, rank, run):
+        self._conn = Client(address, authkey=authkey)
+        self._conn.send_bytes(json.dumps([rank, run]).encode('utf-8'))
+        self._lock = threading.Lock()
+
+    def add_event(self, event):
+        if isinstance(event, event_pb2.Event):
+            event = event.SerializeToString()
+        elif not isinstance(event, bytes):
+            # A DeferredEvent is encoded by the rank, not by the aggregator.
+            event = event.to_event().SerializeToString()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.send_bytes(event)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class _RankFileWriter(SummaryToEventTransformer):
+
+    def __init__(self, logdir, run, address, authkey, rank):
+        super(_RankFileWriter, self).__init__(
+            _RankEventWriter(address, authkey, rank, run))
+        self._logdir = logdir
+
+    def get_logdir(self):
+        return self._logdir
+
+    def add_event(self, event):
+        self.event_writer.add_event(event)
+
+    def get_num_dropped_events(self):
+        return 0
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.event_writer.close()
+
+
+class RankSummaryWriter(SummaryWriter):
+    """A `SummaryWriter` sending its summaries to a `SummaryAggregator`.
+
+    `log_dir` must be the directory of the aggregator. The writer only uses
+    it for the text plugin metadata and for the runs of `add_scalars` with
+    a `main_tag`.
+    """
+
+    def __init__(self, log_dir, address, rank, authkey=None):
+        """
+        Args:
+          log_dir: A string. Directory of the aggregator.
+          address: The `address` of the aggregator.
+          rank: Integer. Rank of this process, from 0 to `num_ranks - 1`.
+          authkey: Optional bytes. Key of the aggregator.
+        """
+        self._log_dir = log_dir
+        self._address = address
+        self._authkey = authkey
+        self.rank = rank
+        super(RankSummaryWriter, self).__init__(log_dir)
+
+    def _make_file_writer(self, logdir):
+        run = os.path.relpath(logdir, self._log_dir)
+        return _RankFileWriter(logdir, '' if run == '.' else run,
+                               self._address, self._authkey, self.rank)
@@ -0,0 +1,90 @@
+"""Hand-rolled encoding of scalar events.
+
+A scalar `Event{wall_time, step, summary{value{tag, simple_value}}}` has a
+fixed wire layout, so it is cheaper to write the bytes directly than to
+build and serialize the protocol buffers. The output is byte-identical to
+`event_pb2.Event.SerializeToString()`.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import struct
+import time
+
+import six
+
+from .summary import _clean_tag
+
+_DOUBLE = struct.Struct('<d')
+_FLOAT = struct.Struct('<f')
+
+# Field keys: (field_number << 3) | wire_type.
+_EVENT_WALL_TIME = b'\x09'  # 1, 64-bit
+_EVENT_STEP = b'\x10'  # 2, varint
+_EVENT_SUMMARY = b'\x2a'  # 5, length delimited
+_SUMMARY_VALUE = b'\x0a'  # 1, length delimited
+_VALUE_TAG = b'\x0a'  # 1, length delimited
+_VALUE_SIMPLE_VALUE = b'\x15'  # 2, 32-bit
+
+
+def _varint(value):
+    """Encodes an int64 as a protobuf varint."""
+    if value < 0:
+        value += 1 << 64
+    out = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _float32(value):
+    try:
+        return _FLOAT.pack(value)
+    except OverflowError:
+        # Like a C cast, protobuf turns doubles beyond the float range into
+        # infinity.
+        return _FLOAT.pack(float('inf') if value > 0 else float('-inf'))
+
+
+class ScalarEventEncoder(object):
+    """Serializes scalar events, caching the encoded prefix of each tag."""
+
+    def __init__(self, max_tags=100000):
+        self._prefixes = {}
+        self._max_tags = max_tags
+
+    def _prefix(self, tag):
+        prefix = self._prefixes.get(tag)
+        if prefix is None:
+            name = _clean_tag(tag)
+            if isinstance(name, six.text_type):
+                name = name.encode('utf-8')
+            value = _VALUE_TAG + _varint(len(name)) + name if name else b''
+            value += _VALUE_SIMPLE_VALUE
+            # The simple value itself adds 4 bytes.
+            summary = _SUMMARY_VALUE + _varint(len(value) + 4) + value
+            prefix = _EVENT_SUMMARY + _varint(len(summary) + 4) + summary
+            if len(self._prefixes) >= self._max_tags:
+                self._prefixes.clear()
+            self._prefixes[tag] = prefix
+        return prefix
+
+    def encode(self, tag, scalar_value, step=None, wall_time=None):
+        """Returns the serialized `Event` holding one scalar summary.
+
+        Args:
+          tag: The tag of the scalar.
+          scalar_value: A real number.
+          step: Optional global step.
+          wall_time: Optional wall time, defaults to now.
+        """
+        if wall_time is None:
+            wall_time = time.time()
+        head = _EVENT_WALL_TIME + _DOUBLE.pack(wall_time) if wall_time else b''
+        if step is not None and int(step) != 0:
+            head += _EVENT_STEP + _varint(int(step))
+        return head + self._prefix(tag) + _float32(float(scalar_value))
@@ -0,0 +1,60 @@
+"""Reads events from disk in a logdir."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import glob
+import os
+
+from .src import event_pb2
+from .record_reader import RecordReader
+
+
+class EventFileReader(object):
+    """Iterates over the `Event` protocol buffers of an event file written by
+    `EventsWriter`, without needing TensorFlow.
+
+    Iteration can be stopped and continued later, also by a new reader
+    created with `offset=reader.offset`, to follow a file that is still
+    being written.
+    """
+
+    def __init__(self, path, offset=0, check_crc=True, use_mmap=False,
+                 compression=None):
+        """
+        Args:
+          path: A string. Path of the event file.
+          offset: Integer. Byte offset of the first event to read.
+          check_crc: Boolean. Whether to verify the record checksums.
+          use_mmap: Boolean. Whether to memory map the file.
+          compression: None, `'gzip'` or `'zlib'`, as given to `FileWriter`.
+        """
+        self._reader = RecordReader(path, offset, check_crc, use_mmap,
+                                    compression)
+
+    @property
+    def path(self):
+        return self._reader.path
+
+    @property
+    def offset(self):
+        """Byte offset of the next event to read."""
+        return self._reader.offset
+
+    def __iter__(self):
+        for payload in self._reader:
+            yield event_pb2.Event.FromString(payload)
+
+
+def event_files(logdir):
+    """Returns the event files in `logdir` in the order they were created."""
+    return sorted(glob.glob(os.path.join(logdir, '*.tfevents.*')))
+
+
+def read_events(logdir, **kwargs):
+    """Yields the events of all event files in `logdir`. Keyword arguments
+    are passed to `EventFileReader`."""
+    for path in event_files(logdir):
+        for event in EventFileReader(path, **kwargs):
+            yield event
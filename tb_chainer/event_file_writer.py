@@ -18,8 +18,12 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
+import errno
+import gzip
 import logging
 import os.path
+import shutil
 import socket
 import threading
 import time
@@ -40,27 +44,79 @@ def directory_check(path):
 class EventsWriter(object):
     '''Writes `Event` protocol buffers to an event file.'''
 
-    def __init__(self, file_prefix):
+    def __init__(self, file_prefix, flush_secs=2, max_file_size=None,
+                 max_file_secs=None, compress_segments=False,
+                 retention_bytes=None, compression=None, keep_open=True,
+                 filename_suffix=''):
         '''
         Events files have a name of the form
-        '/some/file/path/events.out.tfevents.[timestamp].[hostname]'
+        '/some/file/path/events.out.tfevents.[timestamp].[hostname][filename_suffix]'
+        followed by '.[pid].[n]' if another file already has this name, e.g.
+        because it was started within the same second. Files are created
+        exclusively, so writers never truncate each other's files.
+        Records are buffered and written to disk at least every `flush_secs`.
+        A new file is started once the current one holds `max_file_size`
+        bytes or is `max_file_secs` seconds old. Files finished this way are
+        gzipped to
+        '/some/file/path/events.out.tfarchive.[timestamp].[hostname].gz'
+        by a background thread if `compress_segments` is True, and the
+        oldest finished files are deleted while they take more than
+        `retention_bytes` in total. TensorBoard does not read the archives.
+        The current file is never compressed or deleted, also not by
+        `close()`.
+        With `compression='gzip'` or `'zlib'` each file is written as a
+        compressed TFRecord file. With `keep_open=False` the file is only
+        opened to write buffered records, see `RecordWriter`.
         '''
-        self._file_prefix = file_prefix + ".out.tfevents." \
-                            + str(time.time())[:10] + "." + socket.gethostname()
-
-        # Open(Create) the log file with the particular form of name.
-        logging.basicConfig(filename=self._file_prefix)
-
+        self._prefix = file_prefix
+        self._flush_secs = flush_secs
+        self._max_file_size = max_file_size
+        self._max_file_secs = max_file_secs
+        self._compress_segments = compress_segments
+        self._retention_bytes = retention_bytes
+        self._compression = compression
+        self._keep_open = keep_open
+        self._filename_suffix = filename_suffix
+        # Finished files written by this writer, oldest first.
+        self._segments = []
+        # Files finished by `rotate()` waiting for the archiver thread.
+        self._finished = collections.deque()
+        self._archiver = None
+        self._archiver_lock = threading.Lock()
+        # Names before '.[pid].[n]' of the files written by this writer.
+        self._names = set()
         self._num_outstanding_events = 0
-
-        self._py_recordio_writer = RecordWriter(self._file_prefix)
+        self._py_recordio_writer = None
+        self._open()
+
+    def _open(self):
+        name = self._prefix + ".out.tfevents." \
+            + str(time.time())[:10] + "." + socket.gethostname() \
+            + self._filename_suffix
+        self._file_prefix = name
+        if name in self._names:
+            # Compressed or deleted segments no longer take up their name.
+            self._file_prefix = _unique_name(name)
+        while True:
+            try:
+                self._py_recordio_writer = RecordWriter(
+                    self._file_prefix, self._flush_secs,
+                    compression=self._compression, keep_open=self._keep_open,
+                    exclusive=True)
+                break
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+                self._file_prefix = _unique_name(name)
+        self._names.add(name)
+        self._opened_time = time.time()
 
         # Initialize an event instance.
-        self._event = event_pb2.Event()
+        self._event = event_pb2.Event(file_version='brain.Event:2')
 
         self._event.wall_time = time.time()
 
-        self.write_event(self._event)
+        self._write_serialized_event(self._event.SerializeToString())
 
     def write_event(self, event):
         '''Append "event" to the file.'''
@@ -69,22 +125,205 @@ class EventsWriter(object):
         if not isinstance(event, event_pb2.Event):
             raise TypeError("Expected an event_pb2.Event proto, "
                             " but got %s" % type(event))
-        return self._write_serialized_event(event.SerializeToString())
+        self._write_serialized_event(event.SerializeToString())
+        self._maybe_rotate()
+
+    def write_events(self, events):
+        '''Append a batch of "events" to the file. Each event is either an
+        `Event` proto or an already serialized one.'''
+        event_strs = []
+        for event in events:
+            if isinstance(event, bytes):
+                event_strs.append(event)
+            elif isinstance(event, event_pb2.Event):
+                event_strs.append(event.SerializeToString())
+            else:
+                raise TypeError("Expected an event_pb2.Event proto, "
+                                " but got %s" % type(event))
+        self._num_outstanding_events += len(events)
+        self._py_recordio_writer.write_many(event_strs)
+        self._maybe_rotate()
 
     def _write_serialized_event(self, event_str):
         self._num_outstanding_events += 1
         self._py_recordio_writer.write(event_str)
 
+    def _maybe_rotate(self):
+        if (self._max_file_size is not None and
+                self._py_recordio_writer.bytes_written >= self._max_file_size) or \
+           (self._max_file_secs is not None and
+                time.time() - self._opened_time >= self._max_file_secs):
+            self.rotate()
+
+    def rotate(self):
+        '''Closes the current file and continues in a new one.'''
+        path = self._file_prefix
+        self._close()
+        self._open()
+        if self._compress_segments or self._retention_bytes is not None:
+            self._finish_segment(path)
+
+    def _finish_segment(self, path):
+        # Compressing a large file takes a while, so it is not done by the
+        # thread writing the events.
+        with self._archiver_lock:
+            self._finished.append(path)
+            if self._archiver is None:
+                self._archiver = threading.Thread(target=self._archive_segments)
+                self._archiver.daemon = True
+                self._archiver.start()
+
+    def _archive_segments(self):
+        while True:
+            with self._archiver_lock:
+                if not self._finished:
+                    self._archiver = None
+                    return
+                path = self._finished.popleft()
+            try:
+                self._archive_segment(path)
+            except Exception:
+                logging.exception('Failed to archive %s.', path)
+
+    def _archive_segment(self, path):
+        if self._compress_segments:
+            archive = os.path.join(
+                os.path.dirname(path),
+                os.path.basename(path).replace('.tfevents.', '.tfarchive.') + '.gz')
+            # Renamed once complete, so an archive is never truncated.
+            with open(path, 'rb') as src, gzip.open(archive + '.tmp', 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.rename(archive + '.tmp', archive)
+            os.remove(path)
+            path = archive
+        self._segments.append(path)
+        if self._retention_bytes is not None:
+            sizes = [os.path.getsize(p) for p in self._segments]
+            while self._segments and sum(sizes) > self._retention_bytes:
+                os.remove(self._segments.pop(0))
+                sizes.pop(0)
+
+    def wait_for_archiver(self):
+        '''Waits until the files finished by `rotate()` are compressed and
+        the retention limit is applied.'''
+        with self._archiver_lock:
+            archiver = self._archiver
+        if archiver is not None:
+            archiver.join()
+
     def flush(self):
         '''Flushes the event file to disk.'''
+        # `close()` may run on another thread and reset the writer.
+        writer = self._py_recordio_writer
+        if writer is not None:
+            writer.flush()
         self._num_outstanding_events = 0
         return True
 
     def close(self):
-        '''Call self.flush().'''
+        '''Flushes and closes the event file. Waits for the archiver.'''
+        return_value = self._close()
+        self.wait_for_archiver()
+        return return_value
+
+    def _close(self):
         return_value = self.flush()
+        if self._py_recordio_writer is not None:
+            self._py_recordio_writer.close()
+            self._py_recordio_writer = None
         return return_value
 
+    def reopen(self):
+        '''Starts a new event file after `close()`.'''
+        if self._py_recordio_writer is None:
+            self._open()
+
+
+_unique_names = {}
+_unique_names_lock = threading.Lock()
+
+
+def _unique_name(name):
+    """Returns `name.<pid>.<n>` with an `n` not used by a file yet.
+
+    The directory is only scanned for the first collision on `name`, later
+    ones continue from the last `n`. The caller still creates the file
+    exclusively, as another process may take the name first.
+    """
+    prefix = '%s.%d.' % (name, os.getpid())
+    with _unique_names_lock:
+        n = _unique_names.get(prefix)
+        if n is None:
+            dirname, basename = os.path.split(prefix)
+            n = 0
+            for f in os.listdir(dirname or '.'):
+                if f.startswith(basename) and f[len(basename):].isdigit():
+                    n = max(n, int(f[len(basename):]))
+        n += 1
+        _unique_names[prefix] = n
+    # Zero padded, so that the files sort in the order they were started.
+    return '%s%06d' % (prefix, n)
+
+
+class DeferredEvent(object):
+    """An `Event` whose summary is built by the background thread.
+
+    `summary_fn(*args)` must return a `Summary` protocol buffer. The caller
+    hands over ownership of `args`, so they must not be modified afterwards.
+    """
+
+    def __init__(self, summary_fn, args, step=0):
+        self.summary_fn = summary_fn
+        self.args = args
+        self.step = step
+        self.wall_time = time.time()
+
+    def to_event(self):
+        """Builds the summary and wraps it in an `Event`."""
+        return event_pb2.Event(wall_time=self.wall_time, step=self.step,
+                               summary=self.summary_fn(*self.args))
+
+
+OVERFLOW_POLICIES = ('block', 'drop_oldest', 'drop_newest', 'ring')
+
+
+class _OverflowQueue(six.moves.queue.Queue):
+    """A `Queue` whose `put` applies an overflow policy instead of blocking.
+
+    *  `block`: Wait for a free slot like `Queue.put`.
+    *  `drop_oldest`: Discard the oldest pending event.
+    *  `drop_newest`: Discard the event being added.
+    *  `ring`: Keep up to `ring_size` more events in memory, then discard the
+       oldest.
+    Discarded events are counted in `num_dropped`.
+    """
+
+    def __init__(self, maxsize, policy='block', ring_size=10000):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError("overflow_policy must be one of %s, but got %r"
+                             % (OVERFLOW_POLICIES, policy))
+        six.moves.queue.Queue.__init__(self, maxsize)
+        self.policy = policy
+        self.num_dropped = 0
+        self._capacity = maxsize
+        if policy == 'ring' and maxsize > 0:
+            self._capacity += ring_size
+
+    def put(self, item, block=True, timeout=None):
+        if self.policy == 'block' or self._capacity <= 0:
+            return six.moves.queue.Queue.put(self, item, block, timeout)
+        with self.not_full:
+            if self._qsize() >= self._capacity:
+                self.num_dropped += 1
+                if self.policy == 'drop_newest':
+                    return
+                # The dropped event is replaced, so `unfinished_tasks` stays.
+                self._get()
+            else:
+                self.unfinished_tasks += 1
+            self._put(item)
+            self.not_empty.notify()
+
 
 class EventFileWriter(object):
     """Writes `Event` protocol buffers to an event file.
@@ -97,7 +336,12 @@ class EventFileWriter(object):
     @@close
     """
 
-    def __init__(self, logdir, max_queue=10, flush_secs=120):
+    def __init__(self, logdir, max_queue=10, flush_secs=120,
+                 max_batch_size=1024, max_batch_latency=0.,
+                 overflow_policy='block', ring_size=10000,
+                 max_file_size=None, max_file_secs=None,
+                 compress_segments=False, retention_bytes=None,
+                 compression=None, service=None, filename_suffix=''):
         """Creates a `EventFileWriter` and an event file to write to.
         On construction the summary writer creates a new event file in `logdir`.
         This event file will contain `Event` protocol buffers, which are written to
@@ -108,19 +352,77 @@ class EventFileWriter(object):
            and events to disk.
         *  `max_queue`: Maximum number of summaries or events pending to be
            written to disk before one of the 'add' calls block.
+        *  `max_batch_size`, `max_batch_latency`: The background thread drains
+           up to `max_batch_size` queued events at once, waiting at most
+           `max_batch_latency` seconds for more to arrive, and writes them
+           as one batch.
+        *  `overflow_policy`: What `add_event` does when the queue is full.
+           `'block'` waits for the background thread, `'drop_oldest'` and
+           `'drop_newest'` discard an event, and `'ring'` keeps up to
+           `ring_size` extra events in memory before discarding the oldest.
+        *  `max_file_size`, `max_file_secs`: Start a new event file once the
+           current one holds `max_file_size` bytes or is `max_file_secs`
+           seconds old. Files finished this way are gzipped in a background
+           thread if `compress_segments` is True, and the oldest ones are
+           deleted while they take more than `retention_bytes`. TensorBoard
+           does not read the gzipped files. The current event file is always
+           kept as it is.
+        *  `compression`: `'gzip'` or `'zlib'` compresses the event files
+           as TFRecord files of that compression type. Such files are read
+           with `EventFileReader(path, compression=...)` or
+           `tf.data.TFRecordDataset(path, compression_type='GZIP')`, but
+           TensorBoard only loads uncompressed event files. Neither this
+           nor `compress_segments` is readable by TensorBoard; to bound the
+           disk usage of a run TensorBoard watches, rotate the files and
+           set `retention_bytes` instead.
+        *  `filename_suffix`: Appended to the name of the event files, e.g.
+           to tell apart the files of processes writing to the same `logdir`.
+        *  `service`: A `WriterService` whose threads write the events instead
+           of a thread of this writer, e.g. `shared_writer_service()`. The
+           event file is then only opened while buffered events are written
+           to it, and `max_batch_latency` is ignored.
         Args:
           logdir: A string. Directory where event file will be written.
           max_queue: Integer. Size of the queue for pending events and summaries.
           flush_secs: Number. How often, in seconds, to flush the
             pending events and summaries to disk.
+          max_batch_size: Integer. Maximum number of events written together.
+          max_batch_latency: Number. How long, in seconds, to wait for a batch
+            to fill up.
+          overflow_policy: One of `'block'`, `'drop_oldest'`, `'drop_newest'`
+            or `'ring'`.
+          ring_size: Integer. Number of extra events kept by the `'ring'`
+            policy.
+          max_file_size: Optional integer. Size in bytes of an event file.
+          max_file_secs: Optional number. Lifetime in seconds of an event file.
+          compress_segments: Boolean. Whether to gzip event files finished
+            by rotation.
+          retention_bytes: Optional integer. Space in bytes kept for event
+            files finished by rotation.
+          compression: None, `'gzip'` or `'zlib'`.
+          service: Optional `WriterService`.
+          filename_suffix: A string. Suffix of the event file names.
         """
         self._logdir = logdir
         directory_check(self._logdir)
-        self._event_queue = six.moves.queue.Queue(max_queue)
-        self._ev_writer = EventsWriter(os.path.join(self._logdir, "events"))
+        self._event_queue = _OverflowQueue(max_queue, overflow_policy,
+                                           ring_size)
+        self._ev_writer = EventsWriter(os.path.join(self._logdir, "events"),
+                                       flush_secs, max_file_size,
+                                       max_file_secs, compress_segments,
+                                       retention_bytes, compression,
+                                       keep_open=service is None,
+                                       filename_suffix=filename_suffix)
         self._closed = False
-        self._worker = _EventLoggerThread(self._event_queue, self._ev_writer,
-                                          flush_secs)
+        self._service = service
+        if service is None:
+            self._worker = _EventLoggerThread(self._event_queue, self._ev_writer,
+                                              flush_secs, max_batch_size,
+                                              max_batch_latency)
+        else:
+            self._worker = _SharedEventLogger(service, self._event_queue,
+                                              self._ev_writer, flush_secs,
+                                              max_batch_size)
 
         self._worker.start()
 
@@ -128,6 +430,10 @@ class EventFileWriter(object):
         """Returns the directory where event file will be written."""
         return self._logdir
 
+    def get_num_dropped_events(self):
+        """Returns how many events the overflow policy has discarded."""
+        return self._event_queue.num_dropped
+
     def reopen(self):
         """Reopens the EventFileWriter.
         Can be called after `close()` to add more events in the same directory.
@@ -135,15 +441,21 @@ class EventFileWriter(object):
         Does nothing if the EventFileWriter was not closed.
         """
         if self._closed:
+            self._ev_writer.reopen()
+            if self._service is not None:
+                self._worker.start()
             self._closed = False
 
     def add_event(self, event):
         """Adds an event to the event file.
         Args:
-          event: An `Event` protocol buffer.
+          event: An `Event` protocol buffer, a serialized `Event` or a
+            `DeferredEvent`.
         """
         if not self._closed:
             self._event_queue.put(event)
+            if self._service is not None:
+                self._worker.notify()
 
     def flush(self):
         """Flushes the event file to disk.
@@ -158,6 +470,8 @@ class EventFileWriter(object):
         Call this method when you do not need the summary writer anymore.
         """
         self.flush()
+        if self._service is not None:
+            self._worker.stop()
         self._ev_writer.close()
         self._closed = True
 
@@ -165,7 +479,8 @@ class EventFileWriter(object):
 class _EventLoggerThread(threading.Thread):
     """Thread that logs events."""
 
-    def __init__(self, queue, ev_writer, flush_secs):
+    def __init__(self, queue, ev_writer, flush_secs, max_batch_size=1024,
+                 max_batch_latency=0.):
         """Creates an _EventLoggerThread.
         Args:
           queue: A Queue from which to dequeue events.
@@ -173,25 +488,215 @@ class _EventLoggerThread(threading.Thread):
            the visualizer.
           flush_secs: How often, in seconds, to flush the
             pending file to disk.
+          max_batch_size: Maximum number of events dequeued and written
+            together.
+          max_batch_latency: How long, in seconds, to wait for more events
+            once the first event of a batch has arrived.
         """
         threading.Thread.__init__(self)
         self.daemon = True
         self._queue = queue
         self._ev_writer = ev_writer
         self._flush_secs = flush_secs
+        self._max_batch_size = max_batch_size
+        self._max_batch_latency = max_batch_latency
         # The first event will be flushed immediately.
         self._next_event_flush_time = 0
 
     def run(self):
         while True:
-            event = self._queue.get()
             try:
-                self._ev_writer.write_event(event)
+                event = self._queue.get(
+                    timeout=max(self._next_event_flush_time - time.time(), 0.01))
+            except six.moves.queue.Empty:
+                # Nothing arrived for a while, flush what is buffered.
+                try:
+                    self._flush()
+                except Exception:
+                    logging.exception('Failed to flush %s.',
+                                      self._ev_writer._file_prefix)
+                    self._next_event_flush_time = time.time() + self._flush_secs
+                continue
+            events = [event]
+            deadline = time.time() + self._max_batch_latency
+            while len(events) < self._max_batch_size:
+                try:
+                    timeout = deadline - time.time()
+                    if timeout > 0:
+                        events.append(self._queue.get(timeout=timeout))
+                    else:
+                        events.append(self._queue.get_nowait())
+                except six.moves.queue.Empty:
+                    break
+            try:
+                self._ev_writer.write_events(
+                    [e for e in map(_build_event, events) if e is not None])
                 # Flush the event writer every so often.
-                now = time.time()
-                if now > self._next_event_flush_time:
-                    self._ev_writer.flush()
-                    # Do it again in two minutes.
-                    self._next_event_flush_time = now + self._flush_secs
+                if time.time() > self._next_event_flush_time:
+                    self._flush()
+            except Exception:
+                # E.g. a full disk. Keep draining the queue, or the writers
+                # would wait for it forever.
+                logging.exception('Failed to write events to %s.',
+                                  self._ev_writer._file_prefix)
             finally:
+                for _ in events:
+                    self._queue.task_done()
+
+    def _flush(self):
+        self._ev_writer.flush()
+        self._next_event_flush_time = time.time() + self._flush_secs
+
+
+class WriterService(object):
+    """A pool of I/O threads shared by many `EventFileWriter`s.
+
+    Each writer keeps its own queue and file buffer. Writers with pending
+    events take turns in a round-robin queue and a thread writes at most
+    `max_batch_size` events of a writer per turn, so a busy writer does not
+    starve the others. Writers whose buffer is due for a flush are picked up
+    when no events are pending.
+    """
+
+    def __init__(self, num_threads=2):
+        """
+        Args:
+          num_threads: Integer. Number of I/O threads.
+        """
+        self._cond = threading.Condition()
+        self._ready = collections.deque()
+        self._loggers = set()
+        self._threads = []
+        for _ in range(num_threads):
+            thread = threading.Thread(target=self._run)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    @property
+    def num_threads(self):
+        return len(self._threads)
+
+    def _register(self, logger):
+        with self._cond:
+            self._loggers.add(logger)
+
+    def _unregister(self, logger):
+        with self._cond:
+            while logger.scheduled:
+                self._cond.wait()
+            self._loggers.discard(logger)
+
+    def _notify(self, logger):
+        with self._cond:
+            if not logger.scheduled and logger in self._loggers:
+                logger.scheduled = True
+                self._ready.append(logger)
+                self._cond.notify()
+
+    def _next(self):
+        while True:
+            if self._ready:
+                return self._ready.popleft()
+            now = time.time()
+            timeout = None
+            for logger in self._loggers:
+                if logger.scheduled or not logger.dirty:
+                    continue
+                if logger.next_flush_time <= now:
+                    logger.scheduled = True
+                    return logger
+                wait = logger.next_flush_time - now
+                timeout = wait if timeout is None else min(timeout, wait)
+            self._cond.wait(timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                logger = self._next()
+            try:
+                logger.process()
+            except Exception:
+                logging.exception('Failed to write events to %s.',
+                                  logger.ev_writer._file_prefix)
+            with self._cond:
+                if logger.pending():
+                    self._ready.append(logger)
+                else:
+                    logger.scheduled = False
+                self._cond.notify_all()
+
+
+_shared_service = None
+_shared_service_lock = threading.Lock()
+
+
+def shared_writer_service():
+    """Returns the process-wide `WriterService`, creating it on first use."""
+    global _shared_service
+    with _shared_service_lock:
+        if _shared_service is None:
+            _shared_service = WriterService()
+        return _shared_service
+
+
+class _SharedEventLogger(object):
+    """Counterpart of `_EventLoggerThread` run by a `WriterService`."""
+
+    def __init__(self, service, queue, ev_writer, flush_secs,
+                 max_batch_size=1024):
+        self._service = service
+        self._queue = queue
+        self.ev_writer = ev_writer
+        self._flush_secs = flush_secs
+        self._max_batch_size = max_batch_size
+        # Whether the service has queued or is processing this logger.
+        self.scheduled = False
+        # Whether events were written since the last flush, like the
+        # file_version event of a new file.
+        self.dirty = True
+        # The first event will be flushed immediately.
+        self.next_flush_time = 0
+
+    def start(self):
+        self._service._register(self)
+        self.notify()
+
+    def stop(self):
+        self._service._unregister(self)
+
+    def notify(self):
+        self._service._notify(self)
+
+    def pending(self):
+        return not self._queue.empty()
+
+    def process(self):
+        events = []
+        while len(events) < self._max_batch_size:
+            try:
+                events.append(self._queue.get_nowait())
+            except six.moves.queue.Empty:
+                break
+        try:
+            if events:
+                self.ev_writer.write_events(
+                    [e for e in map(_build_event, events) if e is not None])
+                self.dirty = True
+            if self.dirty and time.time() >= self.next_flush_time:
+                self.ev_writer.flush()
+                self.dirty = False
+                self.next_flush_time = time.time() + self._flush_secs
+        finally:
+            for _ in events:
                 self._queue.task_done()
+
+
+def _build_event(event):
+    if not isinstance(event, DeferredEvent):
+        return event
+    try:
+        return event.to_event()
+    except Exception:
+        logging.exception('Failed to build a deferred summary, dropping it.')
+        return None
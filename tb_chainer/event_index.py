@@ -0,0 +1,107 @@
+"""A persistent index of the events in an event file, for polling readers."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+
+from .src import event_pb2
+from .record_reader import RecordReader
+
+
+def index_path(event_path):
+    """Returns the default path of the index of `event_path`.
+
+    The name does not contain 'tfevents', so TensorBoard does not take the
+    index for an event file.
+    """
+    dirname, basename = os.path.split(event_path)
+    return os.path.join(dirname, '.' + basename.replace('tfevents', 'tfindex'))
+
+
+class EventIndex(object):
+    """Byte offset, step, wall time and tags of every event in an event file.
+
+    The index lives in a sidecar file with one JSON line per event and is
+    brought up to date by `update()`, which only reads the events appended
+    to the event file since the last update. Consumers can then go directly
+    to the events they need instead of reading the whole file.
+    """
+
+    def __init__(self, event_path, path=None):
+        """
+        Args:
+          event_path: A string. Path of the event file.
+          path: A string. Path of the index file, see `index_path()` for the
+            default.
+        """
+        self.event_path = event_path
+        self.path = path or index_path(event_path)
+        self.offsets = []
+        self.steps = []
+        self.wall_times = []
+        self.tags = []
+        self._end = 0
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        size = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # Interrupted while appending.
+                entry = json.loads(line.decode('utf-8'))
+                self._add(entry)
+                size += len(line)
+        if size != os.path.getsize(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(size)
+
+    def _add(self, entry):
+        self.offsets.append(entry['offset'])
+        self.steps.append(entry['step'])
+        self.wall_times.append(entry['wall_time'])
+        self.tags.append(frozenset(entry['tags']))
+        self._end = entry['end']
+
+    def update(self):
+        """Indexes the events appended to the event file since the last
+        update. Returns the number of new events."""
+        reader = RecordReader(self.event_path, offset=self._end)
+        lines = []
+        for payload in reader:
+            event = event_pb2.Event.FromString(payload)
+            entry = {'offset': reader.record_offset, 'end': reader.offset,
+                     'step': event.step, 'wall_time': event.wall_time,
+                     'tags': sorted(v.tag for v in event.summary.value)}
+            self._add(entry)
+            lines.append(json.dumps(entry) + '\n')
+        if lines:
+            with open(self.path, 'a') as f:
+                f.write(''.join(lines))
+        return len(lines)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _read(self, indices):
+        reader = RecordReader(self.event_path)
+        with open(self.event_path, 'rb') as f:
+            for i in indices:
+                reader.offset = self.offsets[i]
+                yield event_pb2.Event.FromString(reader.read_record(f))
+
+    def events_after(self, step):
+        """Yields the events whose step is greater than `step`."""
+        return self._read([i for i, s in enumerate(self.steps) if s > step])
+
+    def last_event(self, tag):
+        """Returns the last event with a summary value for `tag`, or None."""
+        for i in range(len(self.tags) - 1, -1, -1):
+            if tag in self.tags[i]:
+                return next(self._read([i]))
+        return None
@@ -0,0 +1,82 @@
+"""Encoding of CPU heavy summaries in worker processes."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import chainer
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+from .src.summary_pb2 import Summary
+
+
+class ProcessPoolEncoder(object):
+    """Runs summary functions such as `image` or `histogram` in a pool of
+    worker processes.
+
+    The input tensor is copied once into a shared memory block which the
+    worker maps, so it is not pickled. The worker sends the serialized
+    `Summary` back.
+    """
+
+    def __init__(self, processes=None):
+        """
+        Args:
+          processes: Number of worker processes. Defaults to the number of
+            CPUs.
+        """
+        self._executor = ProcessPoolExecutor(processes)
+
+    def submit(self, summary_fn, tag, tensor, *args):
+        """Schedules `summary_fn(tag, tensor, *args)`.
+
+        Returns:
+          A future of the serialized `Summary`.
+        """
+        if chainer.backend.get_array_module(tensor) is np:
+            tensor = np.asarray(tensor)
+        else:
+            tensor = chainer.cuda.to_cpu(tensor)
+        if shared_memory is None:
+            return self._executor.submit(_encode, summary_fn, tag, tensor, args)
+        shm = shared_memory.SharedMemory(create=True, size=max(tensor.nbytes, 1))
+        np.ndarray(tensor.shape, tensor.dtype, buffer=shm.buf)[...] = tensor
+        future = self._executor.submit(_encode_shared, summary_fn, tag,
+                                       shm.name, tensor.shape, tensor.dtype,
+                                       args)
+        future.add_done_callback(lambda _: _release(shm))
+        return future
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait)
+
+
+def summary_from_future(future):
+    """Waits for a future returned by `ProcessPoolEncoder.submit` and parses
+    the `Summary`."""
+    return Summary.FromString(future.result())
+
+
+def _encode(summary_fn, tag, tensor, args):
+    return summary_fn(tag, tensor, *args).SerializeToString()
+
+
+def _encode_shared(summary_fn, tag, name, shape, dtype, args):
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return _encode(summary_fn, tag,
+                       np.ndarray(shape, dtype, buffer=shm.buf), args)
+    finally:
+        shm.close()
+
+
+def _release(shm):
+    shm.close()
+    shm.unlink()
@@ -0,0 +1,130 @@
+"""
+To read back tf_records written by `RecordWriter`.
+"""
+
+import io
+import mmap
+import os
+import zlib
+
+from .record_writer import _HEADER, _FOOTER, _WBITS, masked_crc32c
+
+
+class RecordReader(object):
+    """Iterates over the payloads of the tf_records in a file.
+
+    Each record is a little endian uint64 length, the masked CRC-32C of the
+    length, the payload and the masked CRC-32C of the payload. Iteration
+    stops at the end of the file or at a record which is not completely
+    written yet, so a file that is still growing can be read again later
+    from `offset`.
+
+    Files written with a `compression` are decompressed in memory first and
+    offsets then count uncompressed bytes.
+    """
+
+    def __init__(self, path, offset=0, check_crc=True, use_mmap=False,
+                 compression=None):
+        """
+        Args:
+          path: A string. Path of the record file.
+          offset: Integer. Byte offset of the first record to read.
+          check_crc: Boolean. Whether to verify the checksums. Skipping the
+            check is faster but does not detect corrupted records.
+          use_mmap: Boolean. Whether to memory map the file instead of
+            reading it with buffered I/O.
+          compression: None, `'gzip'` or `'zlib'`, as given to `RecordWriter`.
+        """
+        if compression is not None and compression not in _WBITS:
+            raise ValueError("compression must be None, 'gzip' or 'zlib', "
+                             "but got %r" % (compression,))
+        self.path = path
+        self.check_crc = check_crc
+        self.use_mmap = use_mmap
+        self.compression = compression
+        # Offset of the next record to read.
+        self.offset = offset
+        # Offset of the record returned last.
+        self.record_offset = None
+
+    def __iter__(self):
+        if self.compression is not None:
+            return self._read_compressed()
+        if self.use_mmap:
+            return self._read_mmap()
+        return self._read_file()
+
+    def _read_file(self):
+        with open(self.path, 'rb') as f:
+            while True:
+                payload = self.read_record(f)
+                if payload is None:
+                    return
+                yield payload
+
+    def _read_compressed(self):
+        with open(self.path, 'rb') as f:
+            # A decompressobj also returns the data of a file that is not
+            # completely written yet.
+            data = zlib.decompressobj(_WBITS[self.compression]).decompress(f.read())
+        f = io.BytesIO(data)
+        while True:
+            payload = self.read_record(f)
+            if payload is None:
+                return
+            yield payload
+
+    def read_record(self, f):
+        """Reads the record at `offset` from the open file `f`.
+
+        Returns:
+          The payload, or None if the record is not completely written.
+        """
+        f.seek(self.offset)
+        header = f.read(_HEADER.size + _FOOTER.size)
+        if len(header) < _HEADER.size + _FOOTER.size:
+            return None
+        length = self._check_header(header)
+        body = f.read(length + _FOOTER.size)
+        if len(body) < length + _FOOTER.size:
+            return None
+        return self._payload(header, body, length)
+
+    def _read_mmap(self):
+        if os.path.getsize(self.path) <= self.offset:
+            return
+        with open(self.path, 'rb') as f:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            size = len(m)
+            pos = self.offset
+            while pos + _HEADER.size + _FOOTER.size <= size:
+                header = m[pos:pos + _HEADER.size + _FOOTER.size]
+                length = self._check_header(header)
+                end = pos + len(header) + length + _FOOTER.size
+                if end > size:
+                    return
+                yield self._payload(header, m[pos + len(header):end], length)
+                pos = end
+        finally:
+            m.close()
+
+    def _check_header(self, header):
+        length, = _HEADER.unpack_from(header)
+        if self.check_crc:
+            crc, = _FOOTER.unpack_from(header, _HEADER.size)
+            if crc != masked_crc32c(header[:_HEADER.size]):
+                raise IOError('Corrupted record length at offset %d in %s'
+                              % (self.offset, self.path))
+        return length
+
+    def _payload(self, header, body, length):
+        payload = body[:length]
+        if self.check_crc:
+            crc, = _FOOTER.unpack_from(body, length)
+            if crc != masked_crc32c(payload):
+                raise IOError('Corrupted record payload at offset %d in %s'
+                              % (self.offset, self.path))
+        self.record_offset = self.offset
+        self.offset += len(header) + len(body)
+        return payload
@@ -3,36 +3,137 @@ To write tf_record into file. Here we use it for tensorboard's event writting.
 The code was borrow from https://github.com/TeamHG-Memex/tensorboard_logger
 """
 
+import os
 import re
 import struct
+import threading
+import time
+import zlib
 
 from .crc32c import crc32c
+from .utils import memoize
 
 _VALID_OP_NAME_START = re.compile('^[A-Za-z0-9.]')
 _VALID_OP_NAME_PART = re.compile('[A-Za-z0-9_.\\-/]+')
 
+_HEADER = struct.Struct('<Q')
+_FOOTER = struct.Struct('<I')
+
+# zlib window bits of the compression types of TFRecord files.
+_WBITS = {'gzip': 16 + zlib.MAX_WBITS, 'zlib': zlib.MAX_WBITS}
+
 
 class RecordWriter(object):
-    def __init__(self, path, flush_secs=2):
+    """Writes tf_records into a file.
+
+    Records are framed in memory and kept in a buffer which is written out
+    with a single `write` call once `flush_secs` have passed since the last
+    flush, once more than `max_buffer_size` bytes are pending, or when
+    `flush()` is called. `max_buffer_size=0` writes and flushes every record.
+
+    With `compression='gzip'` or `'zlib'` the whole file is compressed like
+    TensorFlow's `TFRecordWriter` does with the same compression type. Each
+    flush ends with a zlib sync point, so the records written so far can be
+    decompressed while the file is still open.
+
+    With `keep_open=False` the file is only opened while a flush writes to
+    it, so many writers do not hold a file descriptor each. With
+    `exclusive=True` creating the writer fails with an `OSError` if `path`
+    already exists, instead of truncating the file.
+    """
+
+    def __init__(self, path, flush_secs=2, max_buffer_size=1 << 20,
+                 compression=None, keep_open=True, exclusive=False):
+        # Set first, `__del__` closes the writer also if `__init__` fails.
+        self._writer = None
+        self._lock = threading.Lock()
+        if compression is not None and compression not in _WBITS:
+            raise ValueError("compression must be None, 'gzip' or 'zlib', "
+                             "but got %r" % (compression,))
         self._name_to_tf_name = {}
         self._tf_names = set()
         self.path = path
-        self.flush_secs = flush_secs  # TODO. flush every flush_secs, not every time.
-        self._writer = None
-        self._writer = open(path, 'wb')
+        self.flush_secs = flush_secs
+        self.max_buffer_size = max_buffer_size
+        self._buffer = []
+        self._buffer_size = 0
+        self._compressor = None
+        if compression is not None:
+            self._compressor = zlib.compressobj(
+                zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, _WBITS[compression])
+        # Bytes of all records written so far, including buffered ones,
+        # before compression.
+        self.bytes_written = 0
+        self._next_flush_time = time.time() + flush_secs
+        self._keep_open = keep_open
+        if exclusive:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL |
+                         getattr(os, 'O_BINARY', 0), 0o666)
+            self._writer = os.fdopen(fd, 'wb')
+        else:
+            self._writer = open(path, 'wb')
+        if not keep_open:
+            self._writer.close()
 
     def write(self, event_str):
-        w = self._writer.write
-        header = struct.pack('Q', len(event_str))
-        w(header)
-        w(struct.pack('I', masked_crc32c(header)))
-        w(event_str)
-        w(struct.pack('I', masked_crc32c(event_str)))
-        self._writer.flush()
+        self.write_many([event_str])
+
+    def write_many(self, event_strs):
+        """Appends several serialized records and flushes at most once."""
+        with self._lock:
+            for event_str in event_strs:
+                record = frame_record(event_str)
+                self._buffer.append(record)
+                self._buffer_size += len(record)
+                self.bytes_written += len(record)
+            if self._buffer_size > self.max_buffer_size or \
+               time.time() >= self._next_flush_time:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self, final=False):
+        if self._writer is None:
+            return
+        data = b''
+        if self._buffer:
+            data = b''.join(self._buffer)
+            if self._compressor is not None:
+                data = self._compressor.compress(data) + \
+                    self._compressor.flush(zlib.Z_SYNC_FLUSH)
+            self._buffer = []
+            self._buffer_size = 0
+        if final and self._compressor is not None:
+            data += self._compressor.flush()
+        if self._keep_open:
+            self._writer.write(data)
+            self._writer.flush()
+        elif data:
+            with open(self.path, 'ab') as f:
+                f.write(data)
+        self._next_flush_time = time.time() + self.flush_secs
+
+    def close(self):
+        with self._lock:
+            if self._writer is not None:
+                self._flush(final=True)
+                self._writer.close()
+                self._writer = None
 
     def __del__(self):
-        if self._writer is not None:
-            self._writer.close()
+        self.close()
+
+
+def frame_record(event_str):
+    """Returns `event_str` framed as a tf_record: length, masked CRC of the
+    length, payload and masked CRC of the payload."""
+    header = _HEADER.pack(len(event_str))
+    return b''.join((header,
+                     _FOOTER.pack(masked_crc32c(header)),
+                     event_str,
+                     _FOOTER.pack(masked_crc32c(event_str))))
 
 
 def masked_crc32c(data):
@@ -44,9 +145,9 @@ def u32(x):
     return x & 0xffffffff
 
 
+@memoize(maxsize=4096)
 def make_valid_tf_name(name):
     if not _VALID_OP_NAME_START.match(name):
         # Must make it valid somehow, but don't want to remove stuff
         name = '.' + name
     return '_'.join(_VALID_OP_NAME_PART.findall(name))
-
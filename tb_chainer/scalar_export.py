@@ -0,0 +1,211 @@
+"""Extraction of scalar curves from event files into NumPy arrays."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import array
+import collections
+import hashlib
+import json
+import os
+import re
+import struct
+
+import numpy as np
+import six
+from six.moves.urllib.parse import quote
+
+from .record_reader import RecordReader
+from .event_file_reader import event_files
+
+ScalarSeries = collections.namedtuple('ScalarSeries', ['step', 'wall_time', 'value'])
+ScalarSeries.__doc__ = """Contiguous `int64` steps, `float64` wall times and
+`float32` values of one tag."""
+
+try:
+    array.array('q')
+    _INT64 = 'q'
+except ValueError:
+    _INT64 = 'l'
+
+_DOUBLE = struct.Struct('<d')
+_FLOAT = struct.Struct('<f')
+
+
+def _read_varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _skip_field(buf, pos, wire_type):
+    if wire_type == 0:
+        return _read_varint(buf, pos)[1]
+    if wire_type == 1:
+        return pos + 8
+    if wire_type == 2:
+        length, pos = _read_varint(buf, pos)
+        return pos + length
+    if wire_type == 5:
+        return pos + 4
+    raise ValueError('Unsupported wire type %d' % wire_type)
+
+
+class _ScalarDecoder(object):
+    """Pulls `(tag, simple_value)` pairs out of serialized `Event` protos.
+
+    Only the fields needed are decoded. Values whose tag does not match
+    `tag_pattern` are skipped before their content is looked at.
+    """
+
+    def __init__(self, tag_pattern=None):
+        self._pattern = re.compile(tag_pattern) if tag_pattern else None
+        # Raw tag bytes -> decoded tag, or None if filtered out.
+        self._tags = {}
+
+    def _tag(self, raw):
+        try:
+            return self._tags[raw]
+        except KeyError:
+            tag = bytes(raw).decode('utf-8')
+            if self._pattern is not None and not self._pattern.search(tag):
+                tag = None
+            self._tags[raw] = tag
+            return tag
+
+    def decode(self, payload):
+        """Returns `(step, wall_time, [(tag, value), ...])` of an event."""
+        if six.PY2:
+            payload = bytearray(payload)
+        step, wall_time, values = 0, 0., []
+        pos, end = 0, len(payload)
+        while pos < end:
+            key, pos = _read_varint(payload, pos)
+            if key == 0x09:  # wall_time
+                wall_time, = _DOUBLE.unpack_from(payload, pos)
+                pos += 8
+            elif key == 0x10:  # step
+                step, pos = _read_varint(payload, pos)
+                if step >= 1 << 63:
+                    step -= 1 << 64
+            elif key == 0x2a:  # summary
+                length, pos = _read_varint(payload, pos)
+                self._decode_summary(payload, pos, pos + length, values)
+                pos += length
+            else:
+                pos = _skip_field(payload, pos, key & 7)
+        return step, wall_time, values
+
+    def _decode_summary(self, buf, pos, end, values):
+        while pos < end:
+            key, pos = _read_varint(buf, pos)
+            if key != 0x0a:  # Summary.value
+                pos = _skip_field(buf, pos, key & 7)
+                continue
+            length, pos = _read_varint(buf, pos)
+            value_end = pos + length
+            tag = None
+            while pos < value_end:
+                key, pos = _read_varint(buf, pos)
+                if key == 0x0a:  # tag
+                    length, pos = _read_varint(buf, pos)
+                    tag = self._tag(buf[pos:pos + length])
+                    pos += length
+                    if tag is None:
+                        break
+                elif key == 0x15 and tag is not None:  # simple_value
+                    values.append((tag, _FLOAT.unpack_from(buf, pos)[0]))
+                    pos += 4
+                else:
+                    pos = _skip_field(buf, pos, key & 7)
+            pos = value_end
+
+
+def _extract(paths, tag_pattern, check_crc):
+    decoder = _ScalarDecoder(tag_pattern)
+    columns = {}
+    for path in paths:
+        for payload in RecordReader(path, check_crc=check_crc):
+            step, wall_time, values = decoder.decode(payload)
+            for tag, value in values:
+                if tag not in columns:
+                    columns[tag] = (array.array(_INT64), array.array('d'), array.array('f'))
+                steps, wall_times, vals = columns[tag]
+                steps.append(step)
+                wall_times.append(wall_time)
+                vals.append(value)
+    return dict((tag, ScalarSeries(np.frombuffer(steps, dtype=np.int64),
+                                   np.frombuffer(wall_times, dtype=np.float64),
+                                   np.frombuffer(vals, dtype=np.float32)))
+                for tag, (steps, wall_times, vals) in columns.items())
+
+
+def _cache_path(path, cache_dir):
+    # Runs started in the same second on the same host have event files of
+    # the same name, so the name alone does not identify a file.
+    digest = hashlib.sha1(os.path.realpath(path).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, '%s.%s' % (os.path.basename(path), digest[:16]))
+
+
+def _cached_extract(path, check_crc, cache_dir):
+    cache = _cache_path(path, cache_dir)
+    meta_path = os.path.join(cache, 'meta.json')
+    stat = os.stat(path)
+    meta = {'size': stat.st_size, 'mtime': stat.st_mtime}
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            cached = json.load(f)
+        if cached['size'] == meta['size'] and cached['mtime'] == meta['mtime']:
+            scalars = {}
+            for tag in cached['tags']:
+                with np.load(os.path.join(cache, quote(tag, safe='') + '.npz')) as npz:
+                    scalars[tag] = ScalarSeries(npz['step'], npz['wall_time'], npz['value'])
+            return scalars
+    scalars = _extract([path], None, check_crc)
+    if not os.path.exists(cache):
+        os.makedirs(cache)
+    for tag, series in scalars.items():
+        np.savez(os.path.join(cache, quote(tag, safe='') + '.npz'), **series._asdict())
+    meta['tags'] = sorted(scalars)
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+    return scalars
+
+
+def read_scalars(path, tag_pattern=None, check_crc=True, cache_dir=None):
+    """Reads all scalar summaries of an event file or a logdir in one pass.
+
+    Args:
+      path: An event file or a directory of event files.
+      tag_pattern: Optional regular expression. Only tags it matches (with
+        `re.search`) are returned. Without `cache_dir` the other tags are not
+        decoded either.
+      check_crc: Boolean. Whether to verify the record checksums.
+      cache_dir: Optional directory to keep the extracted columns of each
+        event file in, as one `.npz` file per tag. A cache entry is rebuilt
+        when the size or the modification time of its event file changes.
+        The entries hold all tags, so building one decodes every scalar of
+        the file regardless of `tag_pattern`.
+
+    Returns:
+      A dict mapping tags to `ScalarSeries`, in the order the events were
+      written.
+    """
+    paths = event_files(path) if os.path.isdir(path) else [path]
+    if cache_dir is None:
+        return _extract(paths, tag_pattern, check_crc)
+    pattern = re.compile(tag_pattern) if tag_pattern else None
+    parts = collections.defaultdict(list)
+    for p in paths:
+        for tag, series in _cached_extract(p, check_crc, cache_dir).items():
+            if pattern is None or pattern.search(tag):
+                parts[tag].append(series)
+    return dict((tag, ScalarSeries(*[np.concatenate(c) for c in zip(*series)]))
+                for tag, series in parts.items())
@@ -34,12 +34,17 @@ from __future__ import division
 from __future__ import print_function
 
 import logging
+import multiprocessing
+import os
 import re as _re
+import threading
 import bisect
+import six
 from six import StringIO
 from six.moves import range
 from PIL import Image
 import numpy as np
+import chainer.backend
 import chainer.cuda
 try:
     import cupy
@@ -51,11 +56,15 @@ from .src.summary_pb2 import HistogramProto
 from .src.summary_pb2 import SummaryMetadata
 from .src.tensor_pb2 import TensorProto
 from .src.tensor_shape_pb2 import TensorShapeProto
+from .utils import memoize
 
 _INVALID_TAG_CHARACTERS = _re.compile(r'[^-/\w\.]')
 
 
+@memoize(maxsize=4096)
 def _clean_tag(name):
+  # The result is cached, so a training loop reusing the same tags only pays
+  # a dict lookup and the warning is logged once per distinct tag.
   # In the past, the first argument to summary ops was a tag, which allowed
   # arbitrary characters. Now we are changing the first argument to be the node
   # name. This has a number of advantages (users of summary ops now can
@@ -95,7 +104,14 @@ def scalar(name, scalar, collections=None):
     return Summary(value=[Summary.Value(tag=name, simple_value=scalar)])
 
 
-def histogram(name, values, bins, collections=None):
+def scalars(tag_scalar_dict):
+    """Outputs a `Summary` protocol buffer with one simple value per entry of
+    `tag_scalar_dict`, a mapping from tag names to real numbers."""
+    return Summary(value=[Summary.Value(tag=_clean_tag(tag), simple_value=float(value))
+                          for tag, value in tag_scalar_dict.items()])
+
+
+def histogram(name, values, bins='tensorflow', collections=None):
     # pylint: disable=line-too-long
     """Outputs a `Summary` protocol buffer with a histogram.
     The generated
@@ -106,7 +122,10 @@ def histogram(name, values, bins, collections=None):
       name: A name for the generated node. Will also serve as a series name in
         TensorBoard.
       values: A real numeric `Tensor`. Any shape. Values to use to
-        build the histogram.
+        build the histogram. CuPy arrays are reduced on their device.
+      bins: `'tensorflow'` for TensorFlow's exponential buckets, or anything
+        `np.histogram` accepts as `bins`. CuPy arrays are copied to the
+        host for the other bin estimators such as `'auto'`.
       collections: Optional list of graph collections keys. The new summary op is
         added to these collections. Defaults to `[GraphKeys.SUMMARIES]`.
     Returns:
@@ -114,32 +133,127 @@ def histogram(name, values, bins, collections=None):
       buffer.
     """
     name = _clean_tag(name)
-    hist = make_histogram(values.astype(float), bins)
+    hist = make_histogram(values, bins)
     return Summary(value=[Summary.Value(tag=name, histo=hist)])
 
 
+_TF_BUCKET_START = 1E-12
+_TF_BUCKET_END = 1E20
+_TF_BUCKET_RATIO = 1.1
+_tf_bucket_limits = None
+
+
+def tensorflow_bins():
+    """Returns the bucket edges TensorFlow's histogram.cc uses by default:
+    +/-1e-12 * 1.1**k up to 1e20 and 0."""
+    global _tf_bucket_limits
+    if _tf_bucket_limits is None:
+        v = _TF_BUCKET_START
+        buckets = []
+        while v < _TF_BUCKET_END:
+            buckets.append(v)
+            v *= _TF_BUCKET_RATIO
+        _tf_bucket_limits = np.array([-b for b in buckets[::-1]] + [0] + buckets)
+        _tf_bucket_limits.flags.writeable = False
+    return _tf_bucket_limits
+
+
+def _tensorflow_bucket_index(values, edges, vmin, vmax):
+    """Returns the index of the bucket of `edges` each value of `values`
+    falls into, dropping values outside of the edges.
+
+    The index is computed from the logarithm of the magnitude. Values close
+    to a bucket boundary are then checked against the edges themselves, so
+    the result is the same as the binary search of `np.histogram`.
+    `values` and `edges` may be NumPy or CuPy arrays.
+    """
+    xp = chainer.backend.get_array_module(values)
+    n = (len(edges) - 1) // 2
+    # Single precision is enough to find the bucket up to the neighbours.
+    q = xp.abs(values, dtype=np.float32)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        xp.log(q, out=q)
+        q -= np.log(_TF_BUCKET_START)
+        q *= 1 / np.log(_TF_BUCKET_RATIO)
+        k = xp.floor(q)
+        q -= k
+        q -= 0.5
+        xp.abs(q, out=q)
+        # A NaN fraction, i.e. a zero or NaN value, is checked as well.
+        near = ~(q < 0.499)
+    # Bucket n + 1 + k for positive values and n - 2 - k for negative ones.
+    xp.fmax(k, -1, out=k)
+    xp.fmin(k, n - 2, out=k)
+    k += 1.5
+    xp.copysign(k, values, out=k)
+    k += n - 0.5
+    index = k.astype(np.intp)
+
+    near = xp.flatnonzero(near)
+    if len(near):
+        v, i = values[near], index[near]
+        i -= v < edges[i]
+        i += v >= edges[i + 1]
+        index[near] = xp.clip(i, 0, len(edges) - 2)
+    if not (edges[0] <= vmin and vmax <= edges[-1]):
+        index = index[(values >= edges[0]) & (values <= edges[-1])]
+    return index
+
+
+def _collapse_empty_buckets(counts, limits):
+    """Merges each run of empty buckets into one like histogram.cc does."""
+    nonzero = counts > 0
+    keep = nonzero | np.append(nonzero[1:], True)
+    counts, limits = counts[keep], limits[keep]
+    if len(counts) == 0:
+        return np.zeros(1), np.array([np.finfo(np.float64).max])
+    return counts, limits
+
 
 def make_histogram(values, bins):
-    """Convert values into a histogram proto using logic from histogram.cc."""
-    values = values.reshape(-1)
-    counts, limits = np.histogram(values, bins=bins)
-    limits = limits[1:]
-
-    sum_sq = values.dot(values)
-    return HistogramProto(min=values.min(),
-                          max=values.max(),
+    """Convert values into a histogram proto using logic from histogram.cc.
+
+    `values` may be a CuPy array, in which case the bucket counts and
+    statistics are computed on its device and only they are transferred.
+    """
+    xp = chainer.backend.get_array_module(values)
+    values = xp.asarray(values).reshape(-1)
+    vmin, vmax = values.min(), values.max()
+    if isinstance(bins, six.string_types) and bins == 'tensorflow':
+        limits = xp.asarray(tensorflow_bins())
+        index = _tensorflow_bucket_index(values, limits, vmin, vmax)
+        counts = xp.bincount(index, minlength=len(limits) - 1)
+    else:
+        if xp is not np:
+            if isinstance(bins, six.string_types):
+                # CuPy has no bin estimators.
+                xp, values = np, chainer.cuda.to_cpu(values)
+                vmin, vmax = values.min(), values.max()
+            elif not isinstance(bins, six.integer_types):
+                bins = xp.asarray(bins)
+        counts, limits = xp.histogram(values, bins=bins)
+    counts, limits = _collapse_empty_buckets(chainer.cuda.to_cpu(counts),
+                                             chainer.cuda.to_cpu(limits[1:]))
+
+    if values.dtype == np.float64:
+        sum_sq = values.dot(values)
+    elif xp is np:
+        sum_sq = np.einsum('i,i->', values, values, dtype=np.float64)
+    else:
+        sum_sq = xp.square(values, dtype=np.float64).sum()
+    return HistogramProto(min=float(vmin),
+                          max=float(vmax),
                           num=len(values),
-                          sum=values.sum(),
-                          sum_squares=sum_sq,
+                          sum=float(values.sum(dtype=np.float64)),
+                          sum_squares=float(sum_sq),
                           bucket_limit=limits,
                           bucket=counts)
 
 
-def image(tag, tensor):
+def image(tag, tensor, dataformats='CHW', encoding=None):
     """Outputs a `Summary` protocol buffer with images.
     The summary has up to `max_images` summary values containing images. The
-    images are built from `tensor` which must be 3-D with shape `[height, width,
-    channels]` and where `channels` can be:
+    images are built from `tensor` whose channels can be:
     *  1: `tensor` is interpreted as Grayscale.
     *  3: `tensor` is interpreted as RGB.
     *  4: `tensor` is interpreted as RGBA.
@@ -151,36 +265,184 @@ def image(tag, tensor):
     Args:
       tag: A name for the generated node. Will also serve as a series name in
         TensorBoard.
-      tensor: A 3-D `uint8` or `float32` `Tensor` of shape `[height, width,
-        channels]` where `channels` is 1, 3, or 4.
+      tensor: A NumPy or CuPy array of shape `[channels, height, width]`,
+        `[height, width, channels]` or `[height, width]` as given by
+        `dataformats`. Floating point values are clipped to [0, 1] and scaled
+        to [0, 255], `uint8` values are used as they are.
+      dataformats: `'CHW'`, `'HWC'` or `'HW'`.
+      encoding: How to encode the image, see `make_image`.
     Returns:
       A scalar `Tensor` of type `string`. The serialized `Summary` protocol
       buffer.
     """
     tag = _clean_tag(tag)
     assert isinstance(tensor, np.ndarray) or isinstance(tensor, cupy.ndarray), 'input tensor should be one of numpy.ndarray, cupy.ndarray'
-    if not isinstance(tensor, np.ndarray):
-        assert tensor.ndim<4 and tensor.ndim>1, 'input tensor should be 3 dimensional.'
-        if tensor.ndim==2:
-            tensor = cupy.expand_dims(tensor, 0)
-        tensor = chainer.cuda.to_cpu(cupy.transpose(tensor, (1,2,0)))
-    else:
-        if tensor.ndim==2:
-            tensor = np.expand_dims(tensor, 0)
-        tensor = np.transpose(tensor, (1,2,0))
-        tensor = tensor.astype(np.float32)
-    tensor = (tensor*255).astype(np.uint8)
-    image = make_image(tensor)
+    image = make_image(_image_to_hwc_uint8(tensor, dataformats), encoding)
     return Summary(value=[Summary.Value(tag=tag, image=image)])
 
 
-def make_image(tensor):
-    """Convert an numpy representation image to Image protobuf"""
+def images(tag, tensor, max_outputs=3, dataformats='NCHW', encoding=None):
+    """Outputs a `Summary` protocol buffer with the first `max_outputs`
+    images of a batch.
+
+    The summary value tags are '*tag*/image' if `max_outputs` is 1 and
+    '*tag*/image/0', '*tag*/image/1', etc. otherwise. The images are encoded
+    in parallel by a pool of threads, as PIL releases the GIL while
+    compressing.
+    Args:
+      tag: A name for the generated node. Will also serve as a series name in
+        TensorBoard.
+      tensor: A NumPy or CuPy array of shape `[batch, channels, height,
+        width]`, `[batch, height, width, channels]` or `[batch, height,
+        width]` as given by `dataformats`, with values as for `image`.
+      max_outputs: Integer. Maximum number of images of the batch to output.
+      dataformats: `'NCHW'`, `'NHWC'` or `'NHW'`.
+      encoding: How to encode the images, see `make_image`.
+    """
+    tag = _clean_tag(tag)
+    assert tensor.ndim == len(dataformats), \
+        'input tensor should be %d dimensional.' % len(dataformats)
+    tensor = tensor[:max_outputs]
+    dataformats = dataformats[1:]
+    xp = chainer.backend.get_array_module(tensor)
+    if xp is not np:
+        # Quantize the whole batch on the device and copy it at once.
+        if dataformats == 'CHW':
+            tensor = tensor.transpose(0, 2, 3, 1)
+        elif dataformats == 'HW':
+            tensor = tensor[..., None]
+        if tensor.dtype != np.uint8:
+            out = xp.empty(tensor.shape, dtype=np.uint8)
+            _quantize_kernel()(tensor, out)
+            tensor = out
+        tensor = chainer.cuda.to_cpu(tensor)
+        dataformats = 'HWC'
+
+    def encode(img):
+        return make_image(_image_to_hwc_uint8(img, dataformats), encoding)
+
+    encoded = list(_encode_pool().map(encode, list(tensor)))
+    if len(encoded) == 1 and max_outputs == 1:
+        names = [tag + '/image']
+    else:
+        names = ['%s/image/%d' % (tag, i) for i in range(len(encoded))]
+    return Summary(value=[Summary.Value(tag=name, image=image)
+                          for name, image in zip(names, encoded)])
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _encode_pool():
+    global _pool, _pool_pid
+    with _pool_lock:
+        # The threads of a pool do not survive a fork, e.g. into the
+        # workers of a ProcessPoolEncoder.
+        if _pool is None or _pool_pid != os.getpid():
+            from concurrent.futures import ThreadPoolExecutor
+            _pool = ThreadPoolExecutor(min(32, multiprocessing.cpu_count()))
+            _pool_pid = os.getpid()
+        return _pool
+
+
+# Number of elements quantized at once on the CPU.
+_QUANTIZE_CHUNK = 1 << 18
+
+
+def _image_to_hwc_uint8(tensor, dataformats='CHW'):
+    """Returns `tensor` as a `[height, width, channels]` `uint8` NumPy array.
+
+    Clipping, scaling and rounding down happen in one pass on the device of
+    `tensor`: a single elementwise kernel for CuPy, row blocks through a
+    small reused buffer for NumPy. An HWC `uint8` NumPy array is returned
+    as it is.
+    """
+    if tensor.ndim == 2 or dataformats == 'HW':
+        assert tensor.ndim == 2, 'input tensor should be 2 dimensional.'
+        tensor = tensor[:, :, None]
+    else:
+        assert tensor.ndim == 3, 'input tensor should be 3 dimensional.'
+        if dataformats == 'CHW':
+            tensor = tensor.transpose(1, 2, 0)
+        else:
+            assert dataformats == 'HWC', "dataformats should be 'CHW', 'HWC' or 'HW'."
+    xp = chainer.backend.get_array_module(tensor)
+    if xp is not np:
+        if tensor.dtype != np.uint8:
+            out = xp.empty(tensor.shape, dtype=np.uint8)
+            _quantize_kernel()(tensor, out)
+            tensor = out
+        return chainer.cuda.to_cpu(tensor)
+    if tensor.dtype == np.uint8:
+        return tensor
+    out = np.empty(tensor.shape, dtype=np.uint8)
+    height, width, channels = tensor.shape
+    rows = max(1, _QUANTIZE_CHUNK // max(1, width * channels))
+    buf = np.empty((min(rows, height), width, channels), dtype=np.float32)
+    for start in range(0, height, rows):
+        src = tensor[start:start + rows]
+        tmp = buf[:len(src)]
+        tmp[...] = src
+        tmp *= 255
+        np.clip(tmp, 0, 255, out=tmp)
+        out[start:start + rows] = tmp
+    return out
+
+
+_quantize = None
+
+
+def _quantize_kernel():
+    global _quantize
+    if _quantize is None:
+        _quantize = cupy.ElementwiseKernel(
+            'T x', 'uint8 y',
+            'y = (unsigned char)min(max((float)x * 255.0f, 0.0f), 255.0f)',
+            'tb_chainer_quantize')
+    return _quantize
+
+
+# Image formats TensorBoard can display, by the names used in encodings.
+IMAGE_FORMATS = {'png': 'PNG', 'jpeg': 'JPEG', 'webp': 'WEBP'}
+
+
+def _parse_encoding(encoding, formats=IMAGE_FORMATS, default='png'):
+    if encoding is None:
+        return formats[default], {}
+    if isinstance(encoding, six.string_types):
+        encoding = {'format': encoding}
+    options = dict(encoding)
+    name = options.pop('format', default).lower()
+    if name not in formats:
+        raise ValueError("format must be one of %s, but got %r"
+                         % (sorted(formats), name))
+    return formats[name], options
+
+
+def make_image(tensor, encoding=None):
+    """Convert an numpy representation image to Image protobuf
+
+    Args:
+      tensor: A `uint8` array of shape `[height, width, channels]`.
+      encoding: None for PNG with the default settings, one of
+        `IMAGE_FORMATS`, or a dict with a `'format'` and options for PIL's
+        `Image.save`, e.g. `{'format': 'png', 'compress_level': 1}`,
+        `{'format': 'png', 'compress_type': zlib.Z_RLE}` for a zlib
+        strategy, `{'format': 'jpeg', 'quality': 75}` or
+        `{'format': 'webp', 'lossless': True}`. JPEG drops the alpha channel.
+        See `examples/benchmark_image_encoders.py` for their speed and size.
+    """
     height, width, channel = tensor.shape
-    image = Image.fromarray(tensor)
+    image_format, options = _parse_encoding(encoding)
+    image = Image.fromarray(tensor[:, :, 0] if channel == 1 else tensor)
+    if image_format == 'JPEG' and channel == 4:
+        image = image.convert('RGB')
+        channel = 3
     import io
     output = io.BytesIO()
-    image.save(output, format='PNG')
+    image.save(output, format=image_format, **options)
     image_string = output.getvalue()
     output.close()
     return Summary.Image(height=height,
@@ -188,64 +450,109 @@ def make_image(tensor):
                          colorspace=channel,
                          encoded_image_string=image_string)
 
-def video(tag, tensor, fps):
+def video(tag, tensor, fps=4, encoding=None):
+    """Outputs a `Summary` protocol buffer with an animation of a batch of
+    videos, tiled in a grid.
+    Args:
+      tag: A name for the generated node. Will also serve as a series name in
+        TensorBoard.
+      tensor: A NumPy or CuPy array of shape `[batch, channels, time, height,
+        width]`. Floating point values are clipped to [0, 1] and scaled to
+        [0, 255], `uint8` values are used as they are.
+      fps: Number. Frames per second.
+      encoding: How to encode the animation, see `make_video`.
+    """
     tag = _clean_tag(tag)
     assert isinstance(tensor, np.ndarray) or isinstance(tensor, cupy.ndarray), 'input tensor should be one of numpy.ndarray, cupy.ndarray'
-    if isinstance(tensor, np.ndarray):
-        xp = np
-    else:
-        xp = cupy
+    xp = chainer.backend.get_array_module(tensor)
 
     assert tensor.ndim==5, 'input tensor should be 5 dimensional. (batch, channels, time, height, width)'
-        
+
     b, c, t, h, w = tensor.shape
 
-    if tensor.dtype == xp.uint8:
-        tensor = xp.float32(tensor) / 255.
+    # pad to power of 2
+    n = 1
+    while n < b:
+        n *= 2
+    if n > b:
+        tensor = xp.concatenate(
+            (tensor, xp.zeros((n - b, c, t, h, w), dtype=tensor.dtype)), axis=0)
+
+    n_rows = 2**(int(np.log2(n)) // 2)
+    n_cols = n // n_rows
+
+    tensor = tensor.reshape(n_rows, n_cols, c, t, h, w)
+    tensor = tensor.transpose(3, 0, 4, 1, 5, 2)
+    tensor = tensor.reshape(t, n_rows * h, n_cols * w, c)
+    if tensor.dtype != np.uint8:
+        if xp is np:
+            tensor = np.clip(tensor * 255, 0, 255).astype(np.uint8)
+        else:
+            out = xp.empty(tensor.shape, dtype=np.uint8)
+            _quantize_kernel()(tensor, out)
+            tensor = out
+
+    tensor = chainer.cuda.to_cpu(tensor)
+    video = make_video(tensor, fps, encoding)
 
-    def is_power2(num):
-        return num != 0 and ((num & (num - 1)) == 0)
+    return Summary(value=[Summary.Value(tag=tag, image=video)])
 
-    # pad to power of 2
-    while not is_power2(tensor.shape[0]):
-        tensor = xp.concatenate((tensor, xp.zeros(shape=(1, c, t, h, w))), axis=0)
 
-    b = tensor.shape[0]
-    n_rows = 2**(int(xp.log(b) / xp.log(2)) // 2)
-    n_cols = b // n_rows
+# Animation formats, by the names used in encodings.
+VIDEO_FORMATS = {'gif': 'GIF', 'apng': 'PNG', 'webp': 'WEBP'}
 
-    tensor = np.reshape(tensor, newshape=(n_rows, n_cols, c, t, h, w))
-    tensor = np.transpose(tensor, axes=(3, 0, 4, 1, 5, 2))
-    tensor = np.reshape(tensor, newshape=(t, n_rows * h, n_cols * w, c))
-    tensor = tensor.astype(xp.float32)
-    tensor = (tensor * 255).astype(xp.uint8)
+_NO_DITHER = getattr(Image, 'Dither', Image).NONE
+# Much faster than the default median cut on the mosaic.
+_FAST_OCTREE = getattr(Image, 'Quantize', Image).FASTOCTREE
 
-    tensor = chainer.cuda.to_cpu(tensor)
-    video = make_video(tensor, fps)
+# Frames sampled to compute the palette of a GIF.
+_PALETTE_SAMPLES = 16
 
-    return Summary(value=[Summary.Value(tag=tag, image=video)])
 
-def make_video(tensor, fps): 
-    try:
-        import moviepy.editor as mpy
-    except ImportError:
-        print('add_video needs package moviepy')
-        return
-    import tempfile
+def _gif_palette(frames):
+    """Returns a `P` image with a 256 color palette for all `frames`,
+    computed from a mosaic of up to `_PALETTE_SAMPLES` of them."""
+    step = max(1, len(frames) // _PALETTE_SAMPLES)
+    mosaic = np.concatenate(frames[::step][:_PALETTE_SAMPLES], axis=0)
+    return Image.fromarray(mosaic).quantize(256, method=_FAST_OCTREE)
 
-    t, h, w, c = tensor.shape
 
-    # encode sequence of images into gif string
-    clip = mpy.ImageSequenceClip(list(tensor), fps=fps)
-    with tempfile.NamedTemporaryFile() as f:
-        filename = f.name + '.gif'
+def make_video(tensor, fps, encoding=None):
+    """Encodes frames into an animated image in memory.
+
+    Args:
+      tensor: A `uint8` array of shape `[time, height, width, channels]`.
+      fps: Number. Frames per second.
+      encoding: None for GIF, one of `VIDEO_FORMATS`, or a dict with a
+        `'format'` and options for PIL's `Image.save`, e.g.
+        `{'format': 'webp', 'lossless': True}`. A GIF uses one palette,
+        computed once, for all frames and has no alpha channel.
+    """
+    t, h, w, c = tensor.shape
+    image_format, options = _parse_encoding(encoding, VIDEO_FORMATS, 'gif')
+    if c == 1:
+        tensor = tensor[..., 0]
+    elif c == 4 and image_format == 'GIF':
+        tensor = tensor[..., :3]
+        c = 3
+    if image_format == 'GIF' and c == 3:
+        palette = _gif_palette(tensor)
+        frames = [Image.fromarray(f).quantize(palette=palette, dither=_NO_DITHER)
+                  for f in tensor]
+    else:
+        frames = [Image.fromarray(f) for f in tensor]
+    options.setdefault('loop', 0)
+    import io
+    output = io.BytesIO()
+    frames[0].save(output, format=image_format, save_all=True,
+                   append_images=frames[1:], duration=int(round(1000. / fps)),
+                   **options)
+    return Summary.Image(height=h, width=w, colorspace=c,
+                         encoded_image_string=output.getvalue())
 
-    clip.write_gif(filename, verbose=True)
-    with open(filename, 'rb') as f:
-        tensor_string = f.read()
-        return Summary.Image(height=h, width=w, colorspace=c, encoded_image_string=tensor_string)
 
 def audio(tag, tensor, sample_rate=44100):
+  tag = _clean_tag(tag)
   tensor = tensor.squeeze()
   assert tensor.ndim==1, 'input tensor should be 1 dimensional.'
   tensor_list = [int(32767.0*x) for x in tensor]
@@ -271,6 +578,7 @@ def audio(tag, tensor, sample_rate=44100):
 
 def text(tag, text):
   import json
+  tag = _clean_tag(tag)
   PluginData = [SummaryMetadata.PluginData(plugin_name='text')]
   smd = SummaryMetadata(plugin_data=PluginData)
   tensor = TensorProto(dtype='DT_STRING', string_val=[text.encode(encoding='utf_8')])
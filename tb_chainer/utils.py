@@ -1,34 +1,91 @@
+import collections
+import functools
 import math
+import threading
+import chainer
 import numpy as np
 irange = range
 
 
+def memoize(maxsize=4096):
+    """Decorator caching the results of a one argument function in a bounded
+    LRU cache. The wrapped function has `cache_info()` (hits, misses,
+    maxsize, currsize), `cache_clear()` and `__wrapped__` like
+    `functools.lru_cache`, which is used when available.
+    """
+    if hasattr(functools, 'lru_cache'):
+        return functools.lru_cache(maxsize)
+
+    def decorator(fn):
+        cache = collections.OrderedDict()
+        lock = threading.Lock()
+        stats = [0, 0]
+
+        @functools.wraps(fn)
+        def wrapper(key):
+            with lock:
+                if key in cache:
+                    stats[0] += 1
+                    value = cache.pop(key)
+                    cache[key] = value
+                    return value
+            value = fn(key)
+            with lock:
+                stats[1] += 1
+                cache[key] = value
+                if len(cache) > maxsize:
+                    cache.popitem(last=False)
+            return value
+
+        def cache_clear():
+            with lock:
+                cache.clear()
+                stats[:] = [0, 0]
+
+        wrapper.cache_info = lambda: _CacheInfo(stats[0], stats[1], maxsize, len(cache))
+        wrapper.cache_clear = cache_clear
+        wrapper.__wrapped__ = fn
+        return wrapper
+    return decorator
+
+
+_CacheInfo = collections.namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
 def make_grid(tensor, nrow=8, padding=2,
-              normalize=False, range=None, scale_each=False, pad_value=0):
+              normalize=False, range=None, scale_each=False, pad_value=0,
+              uint8=False, out=None):
     """Make a grid of images.
 
+    The images are written to the grid all at once through a strided view of
+    it, on the device of `tensor`. Single-channel images are broadcast to the
+    3 channels of the grid.
+
     Args:
         tensor (Tensor or list): 4D mini-batch Tensor of shape (B x C x H x W)
-            or a list of images all of the same size.
+            or a list of images all of the same size. NumPy or CuPy.
         nrows (int, optional): Number of rows in grid. Final grid size is
             (B / nrow, nrow). Default is 8.
-        normalize (bool, optional): If True, shift the image to the range (0, 1),
-            by subtracting the minimum and dividing by the maximum pixel value.
+        normalize (bool, optional): If True, shift the image to the range [0, 1],
+            by subtracting the minimum and dividing by the difference of the
+            maximum and the minimum pixel value.
         range (tuple, optional): tuple (min, max) where min and max are numbers,
             then these numbers are used to normalize the image. By default, min and max
             are computed from the tensor.
         scale_each(bool, optional): If True, scale each image in the batch of
             images separately rather than the (min, max) over all images.
         pad_value(float, optional): Value for the padded pixels.
+        uint8(bool, optional): If True, return a `uint8` grid of shape
+            (H x W x 3) with the values in [0, 1] scaled to [0, 255], ready
+            for PNG encoding, instead of a (3 x H x W) float grid.
+        out(Tensor, optional): With `uint8`, a grid returned by an earlier
+            call to write to instead of allocating a new one. It is only used
+            if it has the right shape and is on the same device.
     """
+    xp = chainer.backend.get_array_module(tensor[0] if isinstance(tensor, list) else tensor)
     # if list of tensors, convert to a 4D mini-batch Tensor
     if isinstance(tensor, list):
-        tensorlist = tensor
-        numImages = len(tensorlist)
-        size = tuple([numImages] + tensorlist[0].shape)
-        tensor = np.zeros(size)
-        for i in irange(numImages):
-            tensor[i] = tensorlist[i].copy()
+        tensor = xp.stack(tensor)
 
     assert tensor.ndim < 5, "'tensor.ndim' must be less than 5. the given 'tensor.ndim' is %d." % tensor.ndim
 
@@ -38,48 +95,73 @@ def make_grid(tensor, nrow=8, padding=2,
         tensor = tensor.reshape((1, tensor.shape[0], tensor.shape[1]))
     if tensor.ndim == 3:  # single image
         if tensor.shape[0] == 1:  # if single-channel, convert to 3-channel
-            tensor = np.concatenate((tensor, tensor, tensor), 0)
+            tensor = xp.repeat(tensor, 3, 0)
+        if uint8:
+            return _to_uint8(xp, tensor).transpose(1, 2, 0)
         return tensor
-    if tensor.ndim == 4 and tensor.shape[1] == 1:  # single-channel images
-        tensor = np.concatenate((tensor, tensor, tensor), 1)
 
     if normalize is True:
         if range is not None:
             assert isinstance(range, tuple), \
                 "range has to be a tuple (min, max) if specified. min and max are numbers"
-
-        def norm_ip(img, min, max):
-            img = img.clip(min=min, max=max)
-            img = (img - min) / (max - min)
-
-        def norm_range(t, range):
-            if range is not None:
-                norm_ip(t, range[0], range[1])
-            else:
-                norm_ip(t, t.min(), t.max())
-
-        if scale_each is True:
-            for t in tensor:  # loop over mini-batch dimension
-                norm_range(t, range)
+        tensor = tensor.astype(xp.result_type(tensor.dtype, xp.float32))
+        if range is not None:
+            low, high = range
+        elif scale_each is True:
+            low = tensor.min(axis=(1, 2, 3), keepdims=True)
+            high = tensor.max(axis=(1, 2, 3), keepdims=True)
         else:
-            norm_range(tensor, range)
+            low, high = tensor.min(), tensor.max()
+        tensor = xp.clip(tensor, low, high)
+        tensor -= low
+        tensor /= xp.maximum(xp.asarray(high - low), 1e-5)
 
     # make the mini-batch of images into a grid
-    nmaps = tensor.shape[0]
+    nmaps, channels, height, width = tensor.shape
     xmaps = min(nrow, nmaps)
     ymaps = int(math.ceil(float(nmaps) / xmaps))
-    height, width = int(tensor.shape[2] + padding), int(tensor.shape[3] + padding)
-    grid = np.ones((3, height * ymaps + 1 + padding // 2, width * xmaps + 1 + padding // 2)) * pad_value
-    k = 0
-    for y in irange(ymaps):
-        for x in irange(xmaps):
-            if k >= nmaps:
-                break
-            grid[:, (y * height + 1 + padding // 2):((y + 1) * height + 1 + padding // 2 - padding), (x * width + 1 + padding // 2):((x + 1) * width + 1 + padding // 2 - padding)] = tensor[k]
-            k += 1
+    offset = 1 + padding // 2
+    shape = ((height + padding) * ymaps + offset, (width + padding) * xmaps + offset)
+    if uint8:
+        tensor = _to_uint8(xp, tensor).transpose(0, 2, 3, 1)
+        shape += (3,)
+        if out is None or out.shape != shape or out.dtype != np.uint8 or \
+           chainer.backend.get_array_module(out) is not xp:
+            out = xp.empty(shape, dtype=np.uint8)
+        grid = out
+        grid[...] = _to_uint8(xp, xp.asarray(pad_value, dtype=np.float32))
+        # (rows, tile height + padding, columns, tile width + padding, C)
+        tiles = grid[offset:, offset:].reshape(
+            ymaps, height + padding, xmaps, width + padding, 3)
+        tiles = tiles[:, :height, :, :width]
+        rows = nmaps // xmaps
+        # Broadcasting along the last axis is slow, so single-channel
+        # images are copied to each channel separately.
+        for c in ([Ellipsis] if channels == 3 else [(Ellipsis, i) for i in irange(3)]):
+            src = tensor if channels == 3 else tensor[..., 0]
+            tiles[c][:rows] = src[:rows * xmaps].reshape(
+                (rows, xmaps, height, width) + src.shape[3:]).swapaxes(1, 2)
+            if rows < ymaps:
+                tiles[c][rows, :, :nmaps - rows * xmaps] = src[rows * xmaps:].swapaxes(0, 1)
+    else:
+        grid = xp.full((3,) + shape, pad_value,
+                       dtype=xp.result_type(tensor.dtype, xp.float32))
+        # (C, rows, tile height + padding, columns, tile width + padding)
+        tiles = grid[:, offset:, offset:].reshape(
+            3, ymaps, height + padding, xmaps, width + padding)
+        tiles = tiles[:, :, :height, :, :width]
+        rows = nmaps // xmaps
+        tiles[:, :rows] = tensor[:rows * xmaps].reshape(
+            rows, xmaps, channels, height, width).transpose(2, 0, 3, 1, 4)
+        if rows < ymaps:
+            tiles[:, rows, :, :nmaps - rows * xmaps] = tensor[rows * xmaps:].transpose(1, 2, 0, 3)
     return grid
 
 
+def _to_uint8(xp, x):
+    return xp.clip(x * 255, 0, 255).astype(np.uint8)
+
+
 def save_image(tensor, filename, nrow=8, padding=2,
                normalize=False, range=None, scale_each=False, pad_value=0):
     """Save a given Tensor into an image file.
@@ -91,7 +173,7 @@ def save_image(tensor, filename, nrow=8, padding=2,
     """
     from PIL import Image
     grid = make_grid(tensor, nrow=nrow, padding=padding, pad_value=pad_value,
-                     normalize=normalize, range=range, scale_each=scale_each)
-    ndarr = (grid * 255).clip(0, 255).astype(np.uint8).transpose((1, 2, 0))
-    im = Image.fromarray(ndarr)
+                     normalize=normalize, range=range, scale_each=scale_each,
+                     uint8=True)
+    im = Image.fromarray(chainer.cuda.to_cpu(grid))
     im.save(filename)
@@ -28,12 +28,20 @@ import chainer.computational_graph as c
 from .src import event_pb2
 from .src import summary_pb2
 from .src import graph_pb2
-from .event_file_writer import EventFileWriter
-from .summary import scalar, histogram, image, audio, text, video
+from .event_file_writer import EventFileWriter, DeferredEvent
+from .event_encoder import ScalarEventEncoder
+from .summary import scalar, scalars, histogram, image, images, audio, text, video, tensorflow_bins, _clean_tag, _parse_encoding
 from .graph import graph, NodeName, build_computational_graph
 from .utils import make_grid
 
 
+def _copy_to_host(x):
+    """Returns a copy of `x` in host memory which the caller does not share."""
+    if chainer.backend.get_array_module(x) is np:
+        return np.array(x)
+    return chainer.cuda.to_cpu(x)
+
+
 class SummaryToEventTransformer(object):
     """Abstractly implements the SummaryWriter API.
     This API basically implements a number of endpoints (add_summary,
@@ -98,6 +106,19 @@ class SummaryToEventTransformer(object):
         event = event_pb2.Event(summary=summary)
         self._add_event(event, global_step)
 
+    def add_deferred_summary(self, summary_fn, args, global_step=None):
+        """Adds a summary which is built by the event writer's thread.
+        Use this for summaries that are expensive to encode, so that the
+        caller only pays for handing over the data.
+        Args:
+          summary_fn: A function returning a `Summary` protocol buffer.
+          args: A tuple of arguments for `summary_fn`. They must not be
+            modified by the caller afterwards.
+          global_step: Number. Optional global step value to record with the
+            summary.
+        """
+        self._add_event(DeferredEvent(summary_fn, args), global_step)
+
     def add_graph(self, graph):
         """Adds a `Graph` protocol buffer to the event file.
         """
@@ -146,7 +167,18 @@ class FileWriter(SummaryToEventTransformer):
                  graph=None,
                  max_queue=10,
                  flush_secs=120,
-                 graph_def=None):
+                 graph_def=None,
+                 max_batch_size=1024,
+                 max_batch_latency=0.,
+                 overflow_policy='block',
+                 ring_size=10000,
+                 max_file_size=None,
+                 max_file_secs=None,
+                 compress_segments=False,
+                 retention_bytes=None,
+                 compression=None,
+                 service=None,
+                 filename_suffix=''):
         """Creates a `FileWriter` and an event file.
         On construction the summary writer creates a new event file in `logdir`.
         This event file will contain `Event` protocol buffers constructed when you
@@ -170,6 +202,15 @@ class FileWriter(SummaryToEventTransformer):
            and events to disk.
         *  `max_queue`: Maximum number of summaries or events pending to be
            written to disk before one of the 'add' calls block.
+        *  `overflow_policy`: What to do instead of blocking when `max_queue`
+           events are pending, see `EventFileWriter`.
+        *  `max_file_size`, `max_file_secs`: When to continue in a new event
+           file, see `EventFileWriter`.
+        *  `compression`: Whether to write compressed event files, which
+           TensorBoard cannot load, see `EventFileWriter`.
+        *  `service`: A `WriterService` to write the events with instead of a
+           thread per writer, see `EventFileWriter`.
+        *  `filename_suffix`: Appended to the name of the event files.
         Args:
           logdir: A string. Directory where event file will be written.
           graph: A `Graph` object, such as `sess.graph`.
@@ -177,18 +218,44 @@ class FileWriter(SummaryToEventTransformer):
           flush_secs: Number. How often, in seconds, to flush the
             pending events and summaries to disk.
           graph_def: DEPRECATED: Use the `graph` argument instead.
+          max_batch_size: Integer. Maximum number of events the background
+            thread writes together.
+          max_batch_latency: Number. How long, in seconds, the background
+            thread waits for a batch to fill up.
+          overflow_policy: One of `'block'`, `'drop_oldest'`, `'drop_newest'`
+            or `'ring'`.
+          ring_size: Integer. Number of extra events kept by the `'ring'`
+            policy.
+          max_file_size: Optional integer. Size in bytes of an event file.
+          max_file_secs: Optional number. Lifetime in seconds of an event file.
+          compress_segments: Boolean. Whether to gzip event files finished
+            by rotation. TensorBoard does not read the gzipped files.
+          retention_bytes: Optional integer. Space in bytes kept for event
+            files finished by rotation.
+          compression: None, `'gzip'` or `'zlib'`.
+          service: Optional `WriterService`, e.g. `shared_writer_service()`.
+          filename_suffix: A string. Suffix of the event file names.
         """
-        event_writer = EventFileWriter(logdir, max_queue, flush_secs)
+        event_writer = EventFileWriter(logdir, max_queue, flush_secs,
+                                       max_batch_size, max_batch_latency,
+                                       overflow_policy, ring_size,
+                                       max_file_size, max_file_secs,
+                                       compress_segments, retention_bytes,
+                                       compression, service, filename_suffix)
         super(FileWriter, self).__init__(event_writer, graph, graph_def)
 
     def get_logdir(self):
         """Returns the directory where event file will be written."""
         return self.event_writer.get_logdir()
 
+    def get_num_dropped_events(self):
+        """Returns how many events the overflow policy has discarded."""
+        return self.event_writer.get_num_dropped_events()
+
     def add_event(self, event):
         """Adds an event to the event file.
         Args:
-          event: An `Event` protocol buffer.
+          event: An `Event` protocol buffer or a serialized one.
         """
         self.event_writer.add_event(event)
 
@@ -221,34 +288,113 @@ class SummaryWriter(object):
     file contents asynchronously. This allows a training program to call methods
     to add data to the file directly from the training loop, without slowing down
     training.
+    If `deferred` is True, `add_image`, `add_histogram`, `add_audio` and
+    `add_video` only copy their input to host memory and leave the encoding
+    to the background thread. Histograms of CuPy arrays are still reduced
+    on the device by the caller, so only their bucket counts are copied. If `encode_processes` is given, they are
+    encoded by a `ProcessPoolEncoder` with that many worker processes instead
+    and written in the order they were added.
+    `image_encoding` is how images are encoded unless `add_image` or
+    `set_image_encoding` say otherwise, see `summary.make_image`.
+    Keyword arguments such as `max_queue`, `flush_secs` or `overflow_policy`
+    are passed to `FileWriter`.
     """
-    def __init__(self, log_dir):
-        self.file_writer = FileWriter(logdir=log_dir)
-        v = 1E-12
-        buckets = []
-        neg_buckets = []
-        while v < 1E20:
-            buckets.append(v)
-            neg_buckets.append(-v)
-            v *= 1.1
-        self.default_bins = neg_buckets[::-1] + [0] + buckets
+    def __init__(self, log_dir, deferred=False, encode_processes=None,
+                 image_encoding=None, **kwargs):
+        self._file_writer_kwargs = kwargs
+        self.file_writer = self._make_file_writer(log_dir)
+        self.all_writers = {}
+        self.deferred = deferred
+        self._encoder = None
+        if encode_processes:
+            from .process_encoder import ProcessPoolEncoder
+            self._encoder = ProcessPoolEncoder(encode_processes)
+        self.default_bins = tensorflow_bins()
+        self.image_encoding = image_encoding
+        self._image_encodings = {}
         self.text_tags = []
+        self._scalar_encoder = ScalarEventEncoder()
+
+    def _make_file_writer(self, logdir):
+        return FileWriter(logdir=logdir, **self._file_writer_kwargs)
+
     def add_scalar(self, name, scalar_value, global_step=None):
-        self.file_writer.add_summary(scalar(name, scalar_value), global_step)
+        self.file_writer.add_event(
+            self._scalar_encoder.encode(name, scalar_value, global_step))
+
+    def add_scalars(self, tag_scalar_dict, global_step=None, main_tag=None):
+        """Adds many scalars with a single event.
+        Args:
+          tag_scalar_dict: A dict from tag names to scalar values.
+          global_step: Number. Optional global step value.
+          main_tag: If given, each value is written with the tag `main_tag`
+            to its own run directory `<log_dir>/<main_tag>_<tag>`, so that
+            TensorBoard draws all of them in one chart.
+        """
+        if main_tag is None:
+            self.file_writer.add_summary(scalars(tag_scalar_dict), global_step)
+            return
+        run_prefix = os.path.join(self.file_writer.get_logdir(),
+                                  main_tag.replace('/', '_') + '_')
+        for tag, value in tag_scalar_dict.items():
+            run_dir = run_prefix + tag
+            if run_dir not in self.all_writers:
+                self.all_writers[run_dir] = self._make_file_writer(run_dir)
+            self.all_writers[run_dir].add_summary(scalar(main_tag, value), global_step)
 
     def add_histogram(self, name, values, global_step=None, bins='tensorflow'):
-        if bins=='tensorflow':
-            bins = self.default_bins
-        self.file_writer.add_summary(histogram(name, values, bins), global_step)
+        if chainer.backend.get_array_module(values) is not np:
+            # Reduced on the device right away, so only the bucket counts
+            # are copied to the host instead of all values.
+            self.file_writer.add_summary(histogram(name, values, bins), global_step)
+        else:
+            self._add_tensor_summary(histogram, name, values, global_step, bins)
+
+    def set_image_encoding(self, tag, encoding):
+        """Sets how the images of `tag` are encoded, see `summary.make_image`.
+        None restores the writer's `image_encoding`."""
+        if encoding is None:
+            self._image_encodings.pop(tag, None)
+        else:
+            _parse_encoding(encoding)
+            self._image_encodings[tag] = encoding
+
+    def _image_encoding(self, tag, encoding=None):
+        if encoding is not None:
+            return encoding
+        return self._image_encodings.get(tag, self.image_encoding)
+
+    def add_image(self, tag, img_tensor, global_step=None, dataformats='CHW',
+                  encoding=None):
+        self._add_tensor_summary(image, tag, img_tensor, global_step, dataformats,
+                                 self._image_encoding(tag, encoding))
+    def add_images(self, tag, img_tensor, global_step=None, max_outputs=3,
+                   dataformats='NCHW', encoding=None):
+        """Adds the first `max_outputs` images of a batch with a single event,
+        see `summary.images`."""
+        self._add_tensor_summary(images, tag, img_tensor[:max_outputs], global_step,
+                                 max_outputs, dataformats,
+                                 self._image_encoding(tag, encoding))
 
-    def add_image(self, tag, img_tensor, global_step=None):
-        self.file_writer.add_summary(image(tag, img_tensor), global_step)
     def add_audio(self, tag, snd_tensor, global_step=None):
-        self.file_writer.add_summary(audio(tag, snd_tensor), global_step)
-    def add_video(self, tag, vid_tensor, global_step=None, fps=4):
-        self.file_writer.add_summary(video(tag, vid_tensor, fps), global_step)
+        self._add_tensor_summary(audio, tag, snd_tensor, global_step)
+    def add_video(self, tag, vid_tensor, global_step=None, fps=4, encoding=None):
+        self._add_tensor_summary(video, tag, vid_tensor, global_step, fps, encoding)
+
+    def _add_tensor_summary(self, summary_fn, tag, tensor, global_step, *args):
+        if self._encoder is not None:
+            from .process_encoder import summary_from_future
+            future = self._encoder.submit(summary_fn, tag, tensor, *args)
+            self.file_writer.add_deferred_summary(
+                summary_from_future, (future,), global_step)
+        elif self.deferred:
+            self.file_writer.add_deferred_summary(
+                summary_fn, (tag, _copy_to_host(tensor)) + args, global_step)
+        else:
+            self.file_writer.add_summary(summary_fn(tag, tensor, *args), global_step)
     def add_text(self, tag, text_string, global_step=None):
         self.file_writer.add_summary(text(tag, text_string), global_step)
+        tag = _clean_tag(tag)
         if tag not in self.text_tags:
             self.text_tags.append(tag)
             extensionDIR = self.file_writer.get_logdir()+'/plugins/tensorboard_text/'
@@ -267,8 +413,8 @@ class SummaryWriter(object):
             if isinstance(n, chainer.variable.VariableNode) and \
                isinstance(n._variable(), chainer.Parameter) and \
                cp.match(names.name(n)):
-                data = chainer.cuda.to_cpu(n._variable().data)
-                self.add_histogram(names.name(n), data, global_step)
+                self.add_histogram(names.name(n), n._variable().data,
+                                   global_step, 'tensorflow')
 
     def add_all_variable_images(self, last_var, exclude_params=True, global_step=None, pattern='.*'):
         cp = re.compile(pattern)
@@ -279,19 +425,35 @@ class SummaryWriter(object):
                (exclude_params and not isinstance(n._variable(), chainer.Parameter)) and \
                n.data is not None and \
                cp.match(names.name(n)):
-                data = chainer.cuda.to_cpu(n.data)
+                # The grids are built and quantized on the device, only
+                # they are copied to the host.
+                data = n.data
+                xp = chainer.backend.get_array_module(data)
                 assert data.ndim < 5, "'variable.data' must be less than 5. the given 'variable.data.ndim' is %d." % data.ndim
                 if data.ndim == 4:
-                    for i, d in enumerate(data):
-                        img = make_grid(np.expand_dims(d, 1) if d.shape[0] != 3 else d)
-                        self.add_image(names.name(n) + '/' + str(i), img, global_step)
+                    grids = xp.stack([make_grid(xp.expand_dims(d, 1) if d.shape[0] != 3 else d,
+                                                uint8=True)
+                                      for d in data])
+                    self._add_tensor_summary(images, names.name(n), grids, global_step,
+                                             len(grids), 'NHWC',
+                                             self._image_encoding(names.name(n)))
                 else:
-                    img = make_grid(np.expand_dims(data, 1) if data.shape[0] != 3 else data)
-                    self.add_image(names.name(n), img, global_step)
+                    img = make_grid(xp.expand_dims(data, 1) if data.shape[0] != 3 else data,
+                                    uint8=True)
+                    self._add_tensor_summary(image, names.name(n), img, global_step, 'HWC',
+                                             self._image_encoding(names.name(n)))
+
+    def get_num_dropped_events(self):
+        return self.file_writer.get_num_dropped_events()
 
     def close(self):
         self.file_writer.flush()
         self.file_writer.close()
+        for writer in self.all_writers.values():
+            writer.flush()
+            writer.close()
+        if self._encoder is not None:
+            self._encoder.shutdown()
 
     def __del__(self):
         if self.file_writer is not None:
@@ -21,3 +21,783 @@ def test_name_scope():
     assert y.node.name_scope == "test"
     assert x.node.name_scope == "test"
     assert not hasattr(z, "name_scope")
+
+def test_crc32c_backends():
+    import os
+    from tb_chainer import crc32c
+    assert crc32c.crc32c(b'123456789') == 0xe3069283
+    data = os.urandom(20000)
+    expected = crc32c._python_crc_update(0, data)
+    default = crc32c.get_backend()
+    try:
+        for name in crc32c.available_backends():
+            crc32c.set_backend(name)
+            assert crc32c.crc32c(data) == expected
+            assert crc32c.crc32c(memoryview(data)) == expected
+            assert crc32c.crc_update(crc32c.crc_update(0, data[:777]), data[777:]) == expected
+    finally:
+        crc32c.set_backend(default)
+
+def test_record_writer_buffering(tmpdir):
+    import os
+    from tb_chainer.record_writer import RecordWriter, frame_record
+    path = str(tmpdir.join('records'))
+    writer = RecordWriter(path, flush_secs=1000)
+    writer.write(b'first')
+    writer.write_many([b'second', b'third'])
+    assert os.path.getsize(path) == 0
+    writer.flush()
+    with open(path, 'rb') as f:
+        assert f.read() == b''.join(frame_record(s) for s in [b'first', b'second', b'third'])
+    writer.close()
+
+def _read_events(logdir):
+    from tb_chainer import read_events
+    return list(read_events(str(logdir)))
+
+def test_event_file_writer_batches(tmpdir):
+    from tb_chainer.event_file_writer import EventFileWriter
+    from tb_chainer.src import event_pb2
+    writer = EventFileWriter(str(tmpdir), max_queue=100, max_batch_size=8,
+                             max_batch_latency=0.01)
+    for i in range(50):
+        writer.add_event(event_pb2.Event(step=i))
+    writer.close()
+    assert [e.step for e in _read_events(tmpdir)] == [0] + list(range(50))
+
+def test_event_file_writer_survives_failed_flush(tmpdir):
+    import time
+    from tb_chainer.event_file_writer import EventFileWriter
+    from tb_chainer.src import event_pb2
+    writer = EventFileWriter(str(tmpdir), flush_secs=0)
+    ev_writer = writer._ev_writer
+    flush = ev_writer.flush
+    failures = []
+
+    def failing_flush():
+        if not failures:
+            failures.append(True)
+            raise AttributeError("'NoneType' object has no attribute 'flush'")
+        return flush()
+    ev_writer.flush = failing_flush
+    time.sleep(0.1)
+    assert failures and writer._worker.is_alive()
+    writer.close()
+    writer.reopen()
+    writer.add_event(event_pb2.Event(step=1))
+    writer.close()
+    steps = [e.step for e in _read_events(tmpdir) if not e.file_version]
+    assert steps == [1]
+
+def test_event_file_writer_survives_failed_write(tmpdir):
+    import errno
+    import os
+    from tb_chainer.event_file_writer import EventFileWriter
+    from tb_chainer.src import event_pb2
+    writer = EventFileWriter(str(tmpdir), max_queue=2)
+    ev_writer = writer._ev_writer
+    write_events = ev_writer.write_events
+
+    def failing_write_events(events):
+        ev_writer.write_events = write_events
+        raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+    ev_writer.write_events = failing_write_events
+    for i in range(5):
+        writer.add_event(event_pb2.Event(step=i))
+    writer.flush()
+    assert writer._worker.is_alive()
+    writer.close()
+    steps = [e.step for e in _read_events(tmpdir) if not e.file_version]
+    assert steps and steps == sorted(steps) and steps[-1] == 4
+
+def test_overflow_queue_policies():
+    from tb_chainer.event_file_writer import _OverflowQueue
+    expected = {'drop_oldest': [2, 3, 4], 'drop_newest': [0, 1, 2],
+                'ring': [0, 1, 2, 3, 4]}
+    for policy, items in expected.items():
+        q = _OverflowQueue(3, policy, ring_size=5)
+        for i in range(5):
+            q.put(i)
+        assert [q.get_nowait() for _ in range(q.qsize())] == items
+        assert q.num_dropped == 5 - len(items)
+        for _ in items:
+            q.task_done()
+        q.join()
+
+def test_deferred_summaries(tmpdir):
+    import numpy as np
+    from tb_chainer import SummaryWriter
+    writer = SummaryWriter(str(tmpdir), deferred=True)
+    img = np.random.rand(3, 8, 8)
+    writer.add_image('image', img, 1)
+    img[...] = 0
+    writer.add_histogram('histogram', np.random.rand(100), 1)
+    writer.close()
+    events = _read_events(tmpdir)[1:]
+    assert [e.summary.value[0].tag for e in events] == ['image', 'histogram']
+    assert events[0].summary.value[0].image.height == 8
+    assert events[1].summary.value[0].histo.num == 100
+
+def test_device_histograms_are_reduced_before_deferring(tmpdir, monkeypatch):
+    import chainer
+    import numpy as np
+    from tb_chainer import SummaryWriter
+    from tb_chainer import writer as writer_module
+    from tb_chainer.summary import make_histogram
+
+    class DeviceArray(np.ndarray):
+        pass
+
+    class DeviceModule(object):
+        """Stands in for CuPy, whose histogram only takes array bins."""
+        def __getattr__(self, name):
+            return getattr(np, name)
+
+        def asarray(self, a, *args, **kwargs):
+            return np.asarray(a, *args, **kwargs).view(DeviceArray)
+
+        def histogram(self, a, bins=10):
+            assert isinstance(bins, (int, np.ndarray)), bins
+            return np.histogram(a, bins)
+
+    device = DeviceModule()
+    get_array_module = chainer.backend.get_array_module
+    monkeypatch.setattr(chainer.backend, 'get_array_module', lambda *arrays:
+                        device if isinstance(arrays[0], DeviceArray)
+                        else get_array_module(*arrays))
+
+    def copy_to_host(x):
+        raise AssertionError('copied to the host')
+    monkeypatch.setattr(writer_module, '_copy_to_host', copy_to_host)
+    values = np.random.randn(1000)
+    writer = SummaryWriter(str(tmpdir), deferred=True)
+    writer.add_histogram('tf', device.asarray(values), 1)
+    writer.add_histogram('list', device.asarray(values), 1, bins=[-1, 0, 1])
+    writer.add_histogram('auto', device.asarray(values), 1, bins='auto')
+    writer.close()
+    events = _read_events(tmpdir)[1:]
+    for e, bins in zip(events, ['tensorflow', [-1, 0, 1], 'auto']):
+        assert e.summary.value[0].histo == make_histogram(values, bins)
+
+def test_process_pool_encoder(tmpdir):
+    import numpy as np
+    from tb_chainer import SummaryWriter
+    writer = SummaryWriter(str(tmpdir), encode_processes=2)
+    for i in range(4):
+        writer.add_image('image', np.random.rand(3, 8, 8), i)
+        writer.add_histogram('histogram', np.random.rand(100), i)
+    writer.close()
+    events = _read_events(tmpdir)[1:]
+    assert [(e.summary.value[0].tag, e.step) for e in events] == \
+        [(tag, i) for i in range(4) for tag in ['image', 'histogram']]
+    assert events[0].summary.value[0].image.width == 8
+
+def test_tensorflow_histogram_matches_np_histogram():
+    import numpy as np
+    from tb_chainer.summary import make_histogram, tensorflow_bins
+    edges = tensorflow_bins()
+    values = np.concatenate([np.random.randn(1000), np.random.randn(1000) * 1e-10,
+                             edges, edges * 0.9999999, [0., -0., 1e25, -1e25]])
+    for dtype in [np.float32, np.float64]:
+        hist = make_histogram(values.astype(dtype), 'tensorflow')
+        counts, _ = np.histogram(values.astype(dtype), bins=edges)
+        assert sum(hist.bucket) == counts.sum()
+        assert np.all(np.cumsum(counts)[np.searchsorted(edges[1:], hist.bucket_limit)] ==
+                      np.cumsum(hist.bucket))
+    hist = make_histogram(np.array([1.0, 2.0]), 'tensorflow')
+    assert list(hist.bucket) == [0, 1, 0, 1, 0]
+
+def test_add_scalars(tmpdir):
+    from tb_chainer import SummaryWriter
+    writer = SummaryWriter(str(tmpdir))
+    writer.add_scalars({'loss': 0.5, 'accuracy': 0.75}, 3)
+    writer.add_scalars({'train': 1., 'test': 2.}, 3, main_tag='loss')
+    writer.close()
+    event = _read_events(tmpdir)[1]
+    assert event.step == 3
+    assert {v.tag: v.simple_value for v in event.summary.value} == {'loss': 0.5, 'accuracy': 0.75}
+    event = _read_events(tmpdir.join('loss_test'))[1]
+    assert (event.summary.value[0].tag, event.summary.value[0].simple_value) == ('loss', 2.)
+
+def test_scalar_event_encoder_matches_protobuf():
+    from tb_chainer.event_encoder import ScalarEventEncoder
+    from tb_chainer.summary import scalar
+    from tb_chainer.src import event_pb2
+    encoder = ScalarEventEncoder()
+    for tag in ['loss', 'a/b', 'illegal tag!', u'é', 'x' * 200]:
+        for step in [None, 0, 1, 127, 128, 2 ** 40, -1]:
+            for value in [0.0, -0.0, 1.5, 7, 1e40, -1e40, 1e-50, float('inf'), float('nan')]:
+                event = event_pb2.Event(summary=scalar(tag, value), wall_time=1234.5)
+                if step is not None:
+                    event.step = step
+                encoded = encoder.encode(tag, value, step, wall_time=1234.5)
+                assert encoded == event.SerializeToString()
+                assert event_pb2.Event.FromString(encoded) == event or value != value
+
+def test_clean_tag_cache():
+    from tb_chainer.summary import _clean_tag
+    _clean_tag.cache_clear()
+    for _ in range(3):
+        assert _clean_tag('/bad tag') == 'bad_tag'
+    assert _clean_tag.cache_info()[:2] == (2, 1)
+
+def test_event_file_reader(tmpdir):
+    import os
+    from tb_chainer import EventFileReader
+    from tb_chainer.record_writer import RecordWriter
+    from tb_chainer.src import event_pb2
+    path = str(tmpdir.join('events.out.tfevents.0'))
+    writer = RecordWriter(path)
+    for i in range(3):
+        writer.write(event_pb2.Event(step=i).SerializeToString())
+    writer.close()
+    with open(path, 'ab') as f:
+        f.write(b'\x05\x00')  # a record being written
+    for use_mmap in [False, True]:
+        reader = EventFileReader(path, use_mmap=use_mmap)
+        assert [e.step for e in reader] == [0, 1, 2]
+        assert reader.offset == os.path.getsize(path) - 2
+        reader = EventFileReader(path, offset=reader.offset, use_mmap=use_mmap)
+        assert list(reader) == []
+    with open(path, 'r+b') as f:
+        f.seek(14)
+        f.write(b'\xff')
+    try:
+        list(EventFileReader(path))
+        assert False
+    except IOError:
+        pass
+    assert len(list(EventFileReader(path, check_crc=False))) == 3
+
+def test_read_scalars(tmpdir):
+    import numpy as np
+    from tb_chainer import SummaryWriter
+    from tb_chainer import read_scalars
+    logdir = tmpdir.join('run')
+    writer = SummaryWriter(str(logdir))
+    for i in range(10):
+        writer.add_scalar('main/loss', 1. / (i + 1), i)
+        writer.add_scalars({'main/accuracy': i / 10., 'lr': 0.1}, i)
+        writer.add_image('image', np.zeros((3, 4, 4)), i)
+    writer.close()
+    scalars = read_scalars(str(logdir), tag_pattern='^main/')
+    assert sorted(scalars) == ['main/accuracy', 'main/loss']
+    assert list(scalars['main/loss'].step) == list(range(10))
+    assert np.allclose(scalars['main/loss'].value, 1. / np.arange(1, 11))
+    cache_dir = str(tmpdir.join('cache'))
+    for _ in range(2):
+        cached = read_scalars(str(logdir), tag_pattern='^main/', cache_dir=cache_dir)
+        assert sorted(cached) == sorted(scalars)
+        for tag in scalars:
+            for a, b in zip(cached[tag], scalars[tag]):
+                assert np.array_equal(a, b)
+    assert len(read_scalars(str(logdir), cache_dir=cache_dir)) == 3
+
+def test_read_scalars_cache_keys_on_path(tmpdir):
+    import os
+    from tb_chainer import read_scalars
+    from tb_chainer.event_file_writer import EventsWriter
+    from tb_chainer.summary import scalar
+    from tb_chainer.src import event_pb2
+    cache_dir = str(tmpdir.join('cache'))
+    paths = []
+    for run, value in [('a', 1.), ('b', 2.)]:
+        tmpdir.join(run).mkdir()
+        writer = EventsWriter(str(tmpdir.join(run, 'events')))
+        writer.write_events([event_pb2.Event(step=0, summary=scalar('loss', value))])
+        writer.close()
+        # Same name, size and modification time as the other run's file.
+        path = str(tmpdir.join(run, 'events.out.tfevents.0.host'))
+        os.rename(writer._file_prefix, path)
+        os.utime(path, (0, 0))
+        paths.append(path)
+    for _ in range(2):
+        assert [read_scalars(p, cache_dir=cache_dir)['loss'].value[0]
+                for p in paths] == [1., 2.]
+
+def test_event_index(tmpdir):
+    from tb_chainer import SummaryWriter
+    from tb_chainer.event_file_reader import event_files
+    from tb_chainer.event_index import EventIndex
+    writer = SummaryWriter(str(tmpdir))
+    for i in range(5):
+        writer.add_scalar('loss', float(i), i)
+    writer.file_writer.flush()
+    path = event_files(str(tmpdir))[0]
+    index = EventIndex(path)
+    assert index.update() == 6
+    for i in range(5, 8):
+        writer.add_scalars({'loss': float(i), 'accuracy': i / 10.}, i)
+    writer.close()
+    index = EventIndex(path)
+    assert len(index) == 6
+    assert index.update() == 3
+    assert [e.step for e in index.events_after(5)] == [6, 7]
+    assert index.last_event('loss').step == 7
+    assert index.last_event('missing') is None
+    assert 'tfevents' not in index.path.split('/')[-1]
+
+def test_event_file_rotation(tmpdir):
+    import gzip
+    from tb_chainer import EventFileReader
+    from tb_chainer import read_events
+    from tb_chainer.event_file_reader import event_files
+    from tb_chainer.event_file_writer import EventsWriter
+    from tb_chainer.src import event_pb2
+    prefix = str(tmpdir.join('events'))
+    writer = EventsWriter(prefix, max_file_size=200)
+    for i in range(20):
+        writer.write_events([event_pb2.Event(step=i, wall_time=i)])
+    writer.close()
+    paths = event_files(str(tmpdir))
+    assert len(paths) > 1
+    for path in paths:
+        assert next(iter(EventFileReader(path))).file_version == 'brain.Event:2'
+    steps = [e.step for e in read_events(str(tmpdir)) if not e.file_version]
+    assert steps == list(range(20))
+    writer.reopen()
+    writer.close()
+    assert len(event_files(str(tmpdir))) == len(paths) + 1
+
+    archive_dir = tmpdir.join('archive')
+    archive_dir.mkdir()
+    writer = EventsWriter(str(archive_dir.join('events')), max_file_size=200,
+                          compress_segments=True, retention_bytes=300)
+    for i in range(20):
+        writer.write_events([event_pb2.Event(step=i, wall_time=i)])
+    for i in range(20, 40):
+        writer.write_event(event_pb2.Event(step=i, wall_time=i))
+    writer.close()
+    # The last file is neither compressed nor deleted.
+    path, = event_files(str(archive_dir))
+    assert [e.step for e in EventFileReader(path)][-1] == 39
+    archives = sorted(str(p) for p in archive_dir.listdir() if str(p) != path)
+    assert 0 < len(archives) < 10
+    assert all(p.endswith('.gz') and '.tfarchive.' in p for p in archives)
+    with gzip.open(archives[-1], 'rb') as f:
+        assert b'brain.Event:2' in f.read()
+
+    # Nothing is deleted without a rotation.
+    single_dir = tmpdir.join('single')
+    single_dir.mkdir()
+    writer = EventsWriter(str(single_dir.join('events')), compress_segments=True,
+                          retention_bytes=100)
+    for i in range(20):
+        writer.write_event(event_pb2.Event(step=i, wall_time=i))
+    writer.close()
+    path, = event_files(str(single_dir))
+    assert len(list(EventFileReader(path))) == 21
+
+def test_compressed_event_files(tmpdir):
+    import zlib
+    import numpy as np
+    from tb_chainer import EventFileReader
+    from tb_chainer import SummaryWriter
+    from tb_chainer.event_file_reader import event_files
+    for compression in ['gzip', 'zlib']:
+        logdir = str(tmpdir.join(compression))
+        writer = SummaryWriter(logdir, compression=compression)
+        for i in range(5):
+            writer.add_histogram('w', np.arange(1000) % 7, i)
+        writer.file_writer.flush()
+        path, = event_files(logdir)
+        # Readable before the file is closed.
+        assert len(list(EventFileReader(path, compression=compression))) == 6
+        writer.close()
+        with open(path, 'rb') as f:
+            data = f.read()
+        assert zlib.decompress(data, 16 + zlib.MAX_WBITS if compression == 'gzip'
+                               else zlib.MAX_WBITS)
+        events = list(EventFileReader(path, compression=compression))
+        assert events[0].file_version == 'brain.Event:2'
+        assert [e.step for e in events[1:]] == list(range(5))
+
+def test_invalid_compression(tmpdir, monkeypatch):
+    import gc
+    import sys
+    from tb_chainer import RecordWriter
+    unraisable = []
+    monkeypatch.setattr(sys, 'unraisablehook', unraisable.append)
+    try:
+        RecordWriter(str(tmpdir.join('records')), compression='lz4')
+        assert False
+    except ValueError:
+        pass
+    gc.collect()
+    assert unraisable == []
+    assert not tmpdir.join('records').exists()
+
+def test_shared_writer_service(tmpdir):
+    import os
+    import threading
+    from tb_chainer import SummaryWriter
+    from tb_chainer import WriterService
+    from tb_chainer import read_scalars
+    from tb_chainer.event_file_reader import event_files
+    service = WriterService(num_threads=2)
+    num_threads = threading.active_count()
+    writers = [SummaryWriter(str(tmpdir.join('run%d' % i)), service=service)
+               for i in range(32)]
+    assert threading.active_count() == num_threads
+    for step in range(20):
+        for i, writer in enumerate(writers):
+            writer.add_scalar('loss', float(i * step), step)
+    for writer in writers:
+        writer.file_writer.flush()
+    fds = '/proc/self/fd'
+    if os.path.isdir(fds):
+        paths = set(os.path.realpath(os.path.join(fds, fd))
+                    for fd in os.listdir(fds))
+        assert not paths & set(os.path.realpath(p) for p in
+                               event_files(str(tmpdir.join('run0'))))
+    for writer in writers:
+        writer.close()
+    for i in range(32):
+        scalars = read_scalars(str(tmpdir.join('run%d' % i)))
+        assert list(scalars['loss'].step) == list(range(20))
+        assert list(scalars['loss'].value) == [i * s for s in range(20)]
+
+def test_async_summary_writer(tmpdir):
+    import asyncio
+    import numpy as np
+    from tb_chainer import AsyncSummaryWriter
+    from tb_chainer import SummaryWriter
+    from tb_chainer import read_events
+
+    def summaries(logdir):
+        return [(e.step, e.summary) for e in read_events(logdir) if e.HasField('summary')]
+
+    writer = SummaryWriter(str(tmpdir.join('sync')))
+    for i in range(20):
+        writer.add_scalar('loss', 1. / (i + 1), i)
+        writer.add_histogram('w', np.arange(i + 1), i)
+    writer.close()
+
+    async def main():
+        writer = AsyncSummaryWriter(str(tmpdir.join('async')), max_queue=4,
+                                    deferred=True)
+        for i in range(10):
+            await writer.add_scalar('loss', 1. / (i + 1), i)
+            await writer.add_histogram('w', np.arange(i + 1), i)
+        await writer.flush()
+        assert len(summaries(str(tmpdir.join('async')))) == 20
+        for i in range(10, 20):
+            await writer.add_scalar('loss', 1. / (i + 1), i)
+            await writer.add_histogram('w', np.arange(i + 1), i)
+        assert writer.get_num_dropped_events() == 0
+        await writer.close()
+        await writer.close()
+        # Ignored after close, without starting a new writing task.
+        await writer.add_scalar('loss', 0., 20)
+        await writer.flush()
+        assert writer.file_writer.event_writer._task is None
+        assert len(asyncio.all_tasks()) == 1
+
+    asyncio.get_event_loop().run_until_complete(main())
+    assert summaries(str(tmpdir.join('async'))) == summaries(str(tmpdir.join('sync')))
+
+def test_async_summary_writer_close_waits_for_flush(tmpdir):
+    import asyncio
+    import threading
+    from tb_chainer import AsyncSummaryWriter
+    from tb_chainer import read_scalars
+
+    async def main():
+        writer = AsyncSummaryWriter(str(tmpdir), flush_secs=0)
+        ev_writer = writer.file_writer.event_writer._ev_writer
+        flush, close = ev_writer.flush, ev_writer.close
+        flushing = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def slow_flush():
+            flushing.set()
+            release.wait(5)
+            calls.append('flush')
+            return flush()
+
+        def recorded_close():
+            calls.append('close')
+            return close()
+        ev_writer.close = recorded_close
+        await writer.add_scalar('loss', 1., 0)
+        await writer.flush()
+        ev_writer.flush = slow_flush
+        # Wait until the task runs an idle flush in the executor.
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, flushing.wait, 5)
+        loop.call_later(0.05, release.set)
+        ev_writer.flush = flush
+        await writer.close()
+        assert calls == ['flush', 'close']
+
+    asyncio.get_event_loop().run_until_complete(main())
+    assert list(read_scalars(str(tmpdir))['loss'].value) == [1.]
+
+    # The writers are only closed if they were created.
+    writer = AsyncSummaryWriter.__new__(AsyncSummaryWriter)
+    writer.__del__()
+
+def _log_rank(log_dir, address, rank):
+    import numpy as np
+    from tb_chainer import RankSummaryWriter
+    writer = RankSummaryWriter(log_dir, address, rank)
+    for step in range(10):
+        writer.add_scalar('loss', float(rank * step), step)
+    writer.add_histogram('w', np.arange(10), 0)
+    writer.close()
+
+def test_summary_aggregator(tmpdir):
+    import multiprocessing
+    import os
+    import numpy as np
+    from tb_chainer import SummaryAggregator
+    from tb_chainer import read_events
+    from tb_chainer import read_scalars
+    from tb_chainer.event_file_reader import event_files
+    log_dir = str(tmpdir)
+    aggregator = SummaryAggregator(log_dir, num_ranks=3)
+    processes = [multiprocessing.Process(target=_log_rank,
+                                         args=(log_dir, aggregator.address, rank))
+                 for rank in range(3)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+    aggregator.close()
+    path, = event_files(log_dir)
+    assert path.endswith('.aggregated.%d' % os.getpid())
+    scalars = read_scalars(log_dir)
+    assert sorted(scalars) == ['loss', 'loss/max', 'loss/min']
+    assert list(scalars['loss'].step) == list(range(10))
+    assert np.allclose(scalars['loss'].value, np.arange(10))
+    assert np.allclose(scalars['loss/max'].value, 2 * np.arange(10))
+    assert np.allclose(scalars['loss/min'].value, 0)
+    tags = sorted(v.tag for e in read_events(log_dir) for v in e.summary.value
+                  if v.HasField('histo'))
+    assert tags == ['rank0/w', 'rank1/w', 'rank2/w']
+
+def test_summary_aggregator_connection_errors(tmpdir):
+    import json
+    import os
+    import socket
+    from multiprocessing.connection import AuthenticationError, Client
+    from tb_chainer import RankSummaryWriter
+    from tb_chainer import SummaryAggregator
+    from tb_chainer import read_scalars
+    from tb_chainer.src import event_pb2
+    log_dir = str(tmpdir.join('logs'))
+    try:
+        SummaryAggregator(log_dir, 1, address=('127.0.0.1', 0))
+        assert False
+    except ValueError:
+        pass
+    aggregator = SummaryAggregator(log_dir, num_ranks=2,
+                                   address=('127.0.0.1', 0), authkey=b'key')
+    # A client which drops during the challenge or has the wrong key.
+    socket.create_connection(aggregator.address).close()
+    try:
+        Client(aggregator.address, authkey=b'wrong')
+        assert False
+    except AuthenticationError:
+        pass
+    # A handshake which is not JSON or names a run outside of log_dir is
+    # refused.
+    conn = Client(aggregator.address, authkey=b'key')
+    conn.send((0, ''))
+    conn.close()
+    outside = str(tmpdir.join('outside'))
+    for run in [outside, '../outside', 'run/../../outside']:
+        conn = Client(aggregator.address, authkey=b'key')
+        conn.send_bytes(json.dumps([0, run]).encode('utf-8'))
+        conn.send_bytes(event_pb2.Event(file_version='x').SerializeToString())
+        conn.close()
+    writer = RankSummaryWriter(log_dir, aggregator.address, 0, authkey=b'key')
+    writer.add_scalar('loss', 1., 0)
+    writer.close()
+    # Rank 1 never connects.
+    aggregator.close(timeout=0.5)
+    assert list(read_scalars(log_dir)['loss'].value) == [1.]
+    assert not os.path.exists(outside)
+
+def test_event_file_names_are_unique(tmpdir):
+    import os
+    from tb_chainer import read_events
+    from tb_chainer.event_file_reader import event_files
+    from tb_chainer.event_file_writer import EventsWriter
+    from tb_chainer.src import event_pb2
+    prefix = str(tmpdir.join('events'))
+    writers = [EventsWriter(prefix) for _ in range(12)]
+    for i, writer in enumerate(writers):
+        writer.write_event(event_pb2.Event(step=i))
+        writer.close()
+    paths = event_files(str(tmpdir))
+    assert len(paths) == 12
+    assert sorted(e.step for e in read_events(str(tmpdir)) if not e.file_version) \
+        == list(range(12))
+    if len(set(os.path.basename(p).split('.')[3] for p in paths)) == 1:
+        # All started within one second.
+        assert paths[1].endswith('.%d.000001' % os.getpid())
+
+def test_make_grid():
+    import numpy as np
+    from tb_chainer.utils import make_grid
+
+    def reference(x, nrow, padding, pad_value):
+        n, c, h, w = x.shape
+        xmaps = min(nrow, n)
+        ymaps = (n + xmaps - 1) // xmaps
+        grid = np.full((3, (h + padding) * ymaps + 1 + padding // 2,
+                        (w + padding) * xmaps + 1 + padding // 2), pad_value)
+        for k in range(n):
+            y = (k // xmaps) * (h + padding) + 1 + padding // 2
+            x0 = (k % xmaps) * (w + padding) + 1 + padding // 2
+            grid[:, y:y + h, x0:x0 + w] = x[k]
+        return grid
+
+    rng = np.random.RandomState(0)
+    out = None
+    for n, c, nrow, padding in [(1, 3, 8, 2), (7, 1, 3, 2), (16, 3, 8, 0), (10, 1, 4, 3)]:
+        x = rng.rand(n, c, 4, 5).astype(np.float32)
+        expected = reference(x, nrow, padding, 0.5)
+        grid = make_grid(x, nrow=nrow, padding=padding, pad_value=0.5)
+        assert grid.shape == expected.shape and np.allclose(grid, expected)
+        out = make_grid(x, nrow=nrow, padding=padding, pad_value=0.5,
+                        uint8=True, out=out)
+        assert out.dtype == np.uint8
+        assert np.array_equal(out, (expected * 255).astype(np.uint8).transpose(1, 2, 0))
+    assert make_grid(x, nrow=4, padding=3, uint8=True, out=out) is out
+    x = rng.rand(4, 1, 3, 3) * 10
+    grid = make_grid(x, normalize=True, padding=0)
+    assert grid.max() == 1 and grid.min() == 0
+    assert make_grid(x, normalize=True, uint8=True).max() == 255
+    grid = make_grid(x, normalize=True, scale_each=True, padding=0)
+    tiles = grid[0, 1:, 1:].reshape(3, 4, 3)
+    assert np.allclose(tiles.max(axis=(0, 2)), 1) and grid.min() == 0
+    grid = make_grid(x, normalize=True, range=(0, 5), padding=0)
+    assert grid.max() == 1 and np.isclose(grid[0, 1:, 1:].min(), x.min() / 5)
+    assert make_grid(np.ones((2, 3, 2, 2)), normalize=True).max() == 0
+
+def test_add_all_variable_images(tmpdir):
+    import io
+    import chainer
+    import chainer.functions as F
+    import numpy as np
+    from PIL import Image
+    from tb_chainer import SummaryWriter
+    from tb_chainer.summary import _image_to_hwc_uint8
+    from tb_chainer.utils import make_grid
+    x = chainer.Variable(np.random.rand(2, 3, 4, 4).astype(np.float32))
+    y = F.relu(x)
+    writer = SummaryWriter(str(tmpdir))
+    writer.add_all_variable_images(y, global_step=1)
+    writer.close()
+    values = [v for e in _read_events(tmpdir) for v in e.summary.value]
+    assert len(values) == 2
+    for v in values:
+        img = np.array(Image.open(io.BytesIO(v.image.encoded_image_string)))
+        expected = _image_to_hwc_uint8(make_grid(x.array[int(v.tag[-1])]))
+        assert np.array_equal(img, expected)
+
+def test_image_quantization():
+    import io
+    import numpy as np
+    from PIL import Image
+    from tb_chainer import summary
+    rng = np.random.RandomState(0)
+    chw = rng.uniform(-0.5, 1.5, (3, 300, 200)).astype(np.float32)
+    expected = (np.clip(chw, 0, 1) * 255).astype(np.uint8).transpose(1, 2, 0)
+    old_chunk = summary._QUANTIZE_CHUNK
+    summary._QUANTIZE_CHUNK = 1000
+    try:
+        assert np.array_equal(summary._image_to_hwc_uint8(chw), expected)
+    finally:
+        summary._QUANTIZE_CHUNK = old_chunk
+    hwc = chw.transpose(1, 2, 0).astype(np.float64)
+    assert np.array_equal(summary._image_to_hwc_uint8(hwc, 'HWC'), expected)
+    assert summary._image_to_hwc_uint8(expected, 'HWC') is expected
+    mask = rng.rand(40, 30) > 0.5
+    value = summary.image('mask', mask).value[0]
+    decoded = np.asarray(Image.open(io.BytesIO(value.image.encoded_image_string)))
+    assert value.image.colorspace == 1
+    assert np.array_equal(decoded, mask * 255)
+
+def test_image_encodings(tmpdir):
+    import numpy as np
+    from tb_chainer import SummaryWriter
+    from tb_chainer import read_events
+    from tb_chainer import summary
+    img = np.random.RandomState(0).rand(3, 32, 32).astype(np.float32)
+    magic = {'png': b'\x89PNG', 'jpeg': b'\xff\xd8', 'webp': b'RIFF'}
+    for encoding, name in [(None, 'png'), ('jpeg', 'jpeg'),
+                           ({'format': 'png', 'compress_level': 1}, 'png'),
+                           ({'format': 'jpeg', 'quality': 50}, 'jpeg'),
+                           ({'format': 'webp', 'lossless': True}, 'webp')]:
+        data = summary.image('x', img, encoding=encoding).value[0].image.encoded_image_string
+        assert data.startswith(magic[name])
+    rgba = np.random.RandomState(0).rand(4, 8, 8)
+    assert summary.image('x', rgba, encoding='jpeg').value[0].image.colorspace == 3
+    try:
+        summary.image('x', img, encoding='bmp')
+        assert False
+    except ValueError:
+        pass
+
+    writer = SummaryWriter(str(tmpdir), image_encoding='jpeg')
+    writer.set_image_encoding('mask', {'format': 'png', 'compress_level': 1})
+    writer.add_image('preview', img, 0)
+    writer.add_image('mask', img, 0)
+    writer.add_image('lossless', img, 0, encoding='webp')
+    writer.close()
+    images = dict((v.tag, v.image.encoded_image_string)
+                  for e in read_events(str(tmpdir)) for v in e.summary.value)
+    assert images['preview'].startswith(magic['jpeg'])
+    assert images['mask'].startswith(magic['png'])
+    assert images['lossless'].startswith(magic['webp'])
+
+def test_add_images(tmpdir):
+    import numpy as np
+    from tb_chainer import SummaryWriter
+    from tb_chainer import read_events
+    from tb_chainer import summary
+    batch = np.random.RandomState(0).rand(10, 1, 16, 16).astype(np.float32)
+    s = summary.images('feat', batch, max_outputs=8)
+    assert [v.tag for v in s.value] == ['feat/image/%d' % i for i in range(8)]
+    for i, v in enumerate(s.value):
+        assert v.image == summary.image('x', batch[i]).value[0].image
+    s = summary.images('feat', batch.transpose(0, 2, 3, 1), max_outputs=1,
+                       dataformats='NHWC')
+    assert [v.tag for v in s.value] == ['feat/image']
+    writer = SummaryWriter(str(tmpdir))
+    writer.add_images('feat', batch, 0, max_outputs=64)
+    writer.close()
+    events = [e for e in read_events(str(tmpdir)) if e.HasField('summary')]
+    assert len(events) == 1
+    assert len(events[0].summary.value) == 10
+
+def test_video_encodings(tmpdir):
+    import io
+    import os
+    import tempfile
+    import numpy as np
+    from PIL import Image
+    from tb_chainer import summary
+    rng = np.random.RandomState(0)
+    vid = rng.rand(3, 3, 5, 16, 16).astype(np.float32)
+    tmp_files = set(os.listdir(tempfile.gettempdir()))
+    for encoding, name in [(None, 'GIF'), ('apng', 'PNG'),
+                           ({'format': 'webp', 'lossless': True}, 'WEBP')]:
+        value = summary.video('v', vid, fps=10, encoding=encoding).value[0]
+        assert (value.image.height, value.image.width) == (32, 32)
+        anim = Image.open(io.BytesIO(value.image.encoded_image_string))
+        assert anim.format == name
+        assert anim.n_frames == 5
+    assert set(os.listdir(tempfile.gettempdir())) == tmp_files
+    gray = (rng.rand(1, 1, 4, 8, 8) * 255).astype(np.uint8)
+    value = summary.video('v', gray).value[0]
+    anim = Image.open(io.BytesIO(value.image.encoded_image_string))
+    frames = []
+    for i in range(4):
+        anim.seek(i)
+        frames.append(np.asarray(anim.convert('L')))
+    assert np.array_equal(np.stack(frames), gray[0, 0])